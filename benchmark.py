@@ -0,0 +1,232 @@
+#benchmark.py
+"""
+端到端 tick 延迟基准测试（不访问真实交易所）。
+
+在独立进程中启动 mock_exchange.py 的模拟 REST 服务器，把各交易所 base_url 指向它，
+然后无界面地运行 main.py 的轮询逻辑（build_monitor + run_tick），
+对不同币种数量统计 tick 延迟 p50/p99、每秒请求数和内存峰值。
+
+用法:
+    python benchmark.py                                   # 8 个交易所比价，1/10/50/100/500 个币种
+    python benchmark.py --exchanges 币安 --ticks 50        # 单个交易所
+    python benchmark.py --latency 0.05 --jitter 0.02 --error-rate 0.01
+    python benchmark.py --save-baseline bench.json        # 保存基线
+    python benchmark.py --baseline bench.json             # 与基线比较，变慢超过 --tolerance 时退出码为 1
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+
+import requests
+
+import main as monitor_app
+import mock_exchange
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 中文交易所名 -> 模拟服务器路径前缀
+MOCK_PREFIXES = {
+    '币安': 'binance',
+    'okx': 'okx',
+    '芝麻开门': 'gate',
+    'bitget': 'bitget',
+    '库币': 'kucoin',
+    '抹茶': 'mexc',
+    '火币': 'huobi',
+    'bybit': 'bybit',
+}
+
+def free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+def start_mock_server(host, port, settings, symbol_count):
+    """在独立进程中启动模拟 REST 服务器，避免与被测代码争抢 GIL"""
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=mock_exchange.serve_http,
+                                      args=(host, port, settings, mock_exchange.make_universe(symbol_count), ready),
+                                      daemon=True)
+    process.start()
+    if not ready.wait(10):
+        process.terminate()
+        raise RuntimeError("模拟行情服务器启动失败")
+    return process
+
+def server_requests(stats_url):
+    return requests.get(stats_url, timeout=5).json()['requests']
+
+def peak_rss_mb():
+    """当前进程内存峰值（MB），不支持时返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def bench_config(symbol_count, exchanges, base_url, args):
+    symbols = [{'symbol': f"S{i}USDT", 'alert_price': 0.0, 'low_alert_price': 0.0} for i in range(symbol_count)]
+    return {
+        'symbols': symbols,
+        'interval': 0,
+        'price_gap_threshold': 1.0,
+        'max_workers': args.max_workers,
+        'tick_deadline': args.tick_deadline,
+        'batch_mode': not args.no_batch,
+        'batch_min_symbols': 2,
+        'batch_exclude': [],
+        'rate_limits': {exchange: 0 for exchange in exchanges},  # 基准测试不限频
+        'base_urls': {exchange: f"{base_url}/{MOCK_PREFIXES[exchange]}" for exchange in exchanges},
+        'http_pool_size': args.max_workers,
+        'connect_timeout': 3.0,
+        'read_timeout': args.tick_deadline,
+    }
+
+def run_case(symbol_count, exchanges, base_url, stats_url, args):
+    """对一个币种数量运行预热 + N 轮 tick，返回统计结果"""
+    config = bench_config(symbol_count, exchanges, base_url, args)
+    monitor_app.configure_http(config)
+    monitor_app.apply_base_urls(config)
+    monitor_app.last_prices.clear()
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        monitor_app.setup_alert_rules(config, config['symbols'], exchanges, verbose=False)
+        monitor = monitor_app.build_monitor(config, exchanges)
+        for _ in range(args.warmup):
+            monitor_app.run_tick(monitor, exchanges)
+
+        latencies = []
+        errors = 0
+        requests_before = server_requests(stats_url)
+        start = time.perf_counter()
+        for _ in range(args.ticks):
+            tick_start = time.perf_counter()
+            results = monitor_app.run_tick(monitor, exchanges)
+            latencies.append((time.perf_counter() - tick_start) * 1000)
+            errors += sum(1 for _, error in results.values() if error)
+        elapsed = time.perf_counter() - start
+        served = server_requests(stats_url) - requests_before
+    return {
+        'symbols': symbol_count,
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(max(latencies), 3),
+        'requests_per_s': round(served / elapsed, 1) if elapsed else 0.0,
+        'requests_per_tick': round(served / args.ticks, 1),
+        'error_rate': round(errors / (args.ticks * symbol_count * len(exchanges)), 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1) if resource is not None else None,
+    }
+
+def print_header():
+    print(f"{'币种数':>6} {'p50(ms)':>10} {'p99(ms)':>10} {'max(ms)':>10} {'请求/s':>9} {'请求/轮':>8} {'错误率':>7} {'内存峰值(MB)':>12}")
+
+def print_row(r):
+    rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else '-'
+    print(f"{r['symbols']:>6} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['max_ms']:>10.2f} "
+          f"{r['requests_per_s']:>9.1f} {r['requests_per_tick']:>8.1f} {r['error_rate']:>7.2%} {rss:>12}")
+
+def compare_baseline(results, baseline, tolerance):
+    """
+    与基线比较 p50/p99 延迟。
+    :return: 变慢超过 tolerance 的条目描述列表
+    """
+    previous = {r['symbols']: r for r in baseline.get('results', [])}
+    regressions = []
+    print(f"\n与基线比较（容差 {tolerance:.0%}）:")
+    for r in results:
+        old = previous.get(r['symbols'])
+        if old is None:
+            print(f"  {r['symbols']:>4} 个币种: 基线中无此项")
+            continue
+        for field in ('p50_ms', 'p99_ms'):
+            change = (r[field] - old[field]) / old[field] if old[field] else 0.0
+            mark = '✅'
+            if change > tolerance:
+                mark = '⚠️'
+                regressions.append(f"{r['symbols']} 个币种 {field}: {old[field]:.2f} -> {r[field]:.2f}ms ({change:+.1%})")
+            print(f"  {mark} {r['symbols']:>4} 个币种 {field}: {old[field]:.2f} -> {r[field]:.2f}ms ({change:+.1%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端 tick 延迟基准测试（本地模拟交易所）")
+    parser.add_argument('--symbols', default='1,10,50,100,500', help="币种数量列表，逗号分隔")
+    parser.add_argument('--exchanges', default=','.join(MOCK_PREFIXES), help="交易所列表，逗号分隔（多个即比价模式）")
+    parser.add_argument('--ticks', type=int, default=30, help="每个币种数量运行的轮数")
+    parser.add_argument('--warmup', type=int, default=3, help="预热轮数（不计入统计）")
+    parser.add_argument('--no-batch', action='store_true', help="关闭批量全量行情请求")
+    parser.add_argument('--max-workers', type=int, default=16)
+    parser.add_argument('--tick-deadline', type=float, default=3.0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help="模拟服务器端口（0 自动选择）")
+    parser.add_argument('--latency', type=float, default=0.0, help="模拟服务器基础延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.0, help="模拟服务器延迟抖动（±秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="模拟服务器返回 500 的概率")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="模拟服务器挂起不响应的概率")
+    parser.add_argument('--save-baseline', metavar='FILE', help="把结果保存为基线 JSON")
+    parser.add_argument('--baseline', metavar='FILE', help="与基线 JSON 比较")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的变慢比例（默认 0.2 即 20%%）")
+    args = parser.parse_args()
+
+    symbol_counts = [int(n) for n in args.symbols.split(',') if n.strip()]
+    exchanges = [e.strip() for e in args.exchanges.split(',') if e.strip()]
+    unknown = [e for e in exchanges if e not in MOCK_PREFIXES]
+    if unknown:
+        parser.error(f"未知交易所: {', '.join(unknown)}（可选: {', '.join(MOCK_PREFIXES)}）")
+
+    port = args.port or free_port(args.host)
+    settings = mock_exchange.MockSettings(args.latency, args.jitter, args.error_rate, args.timeout_rate,
+                                          timeout_sleep=args.tick_deadline * 2)
+    server = start_mock_server(args.host, port, settings, max(symbol_counts))
+    base_url = f"http://{args.host}:{port}"
+    stats_url = f"{base_url}/__stats"
+
+    mode = '比价' if len(exchanges) > 1 else '单交易所'
+    print(f"基准测试: {mode}模式 {', '.join(exchanges)}，每项 {args.ticks} 轮，批量请求: {'关' if args.no_batch else '开'}，"
+          f"模拟延迟 {args.latency * 1000:.0f}±{args.jitter * 1000:.0f}ms，错误率 {args.error_rate:.1%}，超时率 {args.timeout_rate:.1%}")
+    print_header()
+    results = []
+    try:
+        for count in symbol_counts:
+            results.append(run_case(count, exchanges, base_url, stats_url, args))
+            print_row(results[-1])
+    finally:
+        server.terminate()
+        server.join(5)
+
+    report = {
+        'exchanges': exchanges,
+        'ticks': args.ticks,
+        'batch_mode': not args.no_batch,
+        'mock': {'latency': args.latency, 'jitter': args.jitter,
+                 'error_rate': args.error_rate, 'timeout_rate': args.timeout_rate},
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存: {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"⚠️ 性能回退 {len(regressions)} 项:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("✅ 未发现超过容差的性能回退。")
+
+if __name__ == "__main__":
+    main()
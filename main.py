@@ -1,40 +1,137 @@
 #main.py
+import asyncio
+import bisect
+import collections
+import functools
+import gzip
+import json
+import math
+import mmap
+import multiprocessing
+import queue
 import requests
+from requests.adapters import HTTPAdapter
 import time
-import pygame
+import shutil
 import signal
+import struct
+import threading
 import sys
 import os
+import argparse
 import yaml
+from dataclasses import dataclass, field
+from typing import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_launch_time = time.perf_counter()  # 启动时间，用于统计首个价格耗时
 
 # 全局变量：每个币种的上次价格，用于计算变化率
 last_prices = {}  # dict: (symbol, exchange) -> last_price
-alert_channels = {}  # dict: symbol -> Channel (for alert sound, per symbol regardless of exchange)
+price_history = None  # PriceHistory：每个 (symbol, exchange) 的环形历史缓冲区
+change_window = 0  # 变化率窗口（秒），0 表示相对上一次价格
+alert_engine = None  # AlertEngine：单个交易所模式的多档位价格报警
+daemon_mode = False  # 守护模式：不交互，退出时不等待按键
+shard_pool = None  # ShardPool：多进程分片模式的工作进程和共享内存价格表
+message_forwarder = None  # 多进程分片的工作进程：提示消息交给协调进程输出（协调进程才知道仪表盘等显示方式）
+alert_dispatcher = None  # AlertDispatcher：报警分发线程（None 时报警直接输出到控制台）
+first_price_time = None  # 启动到第一个价格到达的秒数
+
+# 并发抓取线程池（懒创建，跨 tick 复用）
+_fetch_executor = None
+_fetch_executor_size = 0
+STALE_ERROR = "数据过期: 超过本轮截止时间未返回"
+RATE_LIMITED_ERROR = "限流: 本轮请求配额已用完，跳过"
+CIRCUIT_OPEN_ERROR = "数据过期: 交易所熔断中，暂停请求"
+
+REQUEST_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+
+# 每个交易所一个长连接 Session（keep-alive 连接池），避免每次轮询重新 TCP+TLS 握手
+_sessions = {}  # dict: exchange -> requests.Session
+_sessions_lock = threading.Lock()
+http_settings = {
+    'pool_size': 16,  # 每个交易所连接池大小
+    'connect_timeout': 3.0,
+    'read_timeout': 5.0,
+    'exchange_timeouts': {},  # dict: exchange -> [connect, read]
+    'adaptive_timeout': True,  # 按近期 p99 耗时收紧读取超时
+    'timeout_p99_multiplier': 3.0,
+    'min_read_timeout': 1.0,
+    'hedge_delay': 'auto',  # 关键币种对冲请求延迟（秒），'auto' 为近期 p90 耗时
+}
+
+ANSI_COLORS = {
+    'red': '\033[91m',
+    'green': '\033[92m',
+    'yellow': '\033[93m',
+    'blue': '\033[94m',
+    'end': '\033[0m'
+}
+
+# 仪表盘渲染器（display_mode: dashboard 时启用，None 为滚动日志模式）
+dashboard = None
+
+# 比价报警突出打印时的交易所列宽（与 print_aligned 一致）
+GAP_EX_DISPLAY_WIDTH = 16
 
+@functools.lru_cache(maxsize=4096)
 def display_width(s):
-    """计算字符串的显示宽度（汉字/全角为2，ASCII为1）"""
+    """计算字符串的显示宽度（汉字/全角为2，ASCII为1），结果缓存"""
     return sum(2 if ord(c) > 127 else 1 for c in s)
 
+@functools.lru_cache(maxsize=1024)
+def pad_display(s, width):
+    """按显示宽度截断并右侧补空格到 width"""
+    if display_width(s) > width:
+        out, used = [], 0
+        for c in s:
+            w = 2 if ord(c) > 127 else 1
+            if used + w > width:
+                break
+            out.append(c)
+            used += w
+        s = ''.join(out)
+    return s + ' ' * (width - display_width(s))
+
 def signal_handler(sig, frame):
     """优雅退出：停止所有声音并退出"""
-    print("\n监控停止。按任意键退出...")
-    if pygame.mixer.get_init():
+    if alert_dispatcher is not None:
+        alert_dispatcher.close()  # 尽量送出队列中剩余的报警
+    if dashboard is not None:
+        dashboard.close()
+    if price_history is not None:
+        price_history.close()
+    if shard_pool is not None:
+        shard_pool.close()
+    print("\n监控停止。" if daemon_mode else "\n监控停止。按任意键退出...")
+    pygame = sys.modules.get('pygame')  # 只有报过警才会导入
+    if pygame is not None and pygame.mixer.get_init():
         pygame.mixer.quit()  # 停止所有声音
     sys.exit(0)
 
+def _emit(line):
+    """写出一行到终端，耗时计入 render 阶段"""
+    start = time.perf_counter()
+    print(line)
+    metrics.add_render_seconds(time.perf_counter() - start)
+
 def print_colored(text, color='red'):
-    """打印彩色文本（ANSI转义码）"""
-    colors = {
-        'red': '\033[91m',
-        'green': '\033[92m',
-        'yellow': '\033[93m',
-        'blue': '\033[94m',
-        'end': '\033[0m'
-    }
-    print(f"{colors.get(color, '')}{text}{colors['end']}")
+    """打印彩色文本（ANSI转义码），仪表盘模式下进入消息区；分片工作进程中转交协调进程输出"""
+    if message_forwarder is not None:
+        message_forwarder(text, color)
+        return
+    if dashboard is not None:
+        dashboard.add_message(text, color)
+        return
+    _emit(f"{ANSI_COLORS.get(color, '')}{text}{ANSI_COLORS['end']}")
 
 def print_aligned(timestamp, exchange, formatted_symbol, current_price, change_pct, is_alert=False, is_invalid=False, is_error=False):
-    """打印对齐的价格信息"""
+    """打印对齐的价格信息，仪表盘模式下只更新对应单元格"""
+    if dashboard is not None:
+        dashboard.set_price(exchange, formatted_symbol, current_price, change_pct, is_alert, is_invalid, is_error)
+        return
+
     # 定义列宽度（显示宽度）
     ts_width = 19  # 时间戳显示宽（实际字符19 +1空格）
     ex_display_width = 8  # 交易所列显示宽
@@ -42,159 +139,2021 @@ def print_aligned(timestamp, exchange, formatted_symbol, current_price, change_p
     price_width = 8  # 价格列显示宽
     change_width = 4  # 变化列显示宽
     
-    ex_base = exchange.upper()
-    base_width = display_width(ex_base)
-    pad_chars = max(0, ex_display_width - base_width)
-    ex_display = ex_base + ' ' * pad_chars
+    ex_display = pad_display(exchange.upper(), ex_display_width)
     
-    price_str = f"{current_price:>14.4f}"
+    price_str = f"{current_price:>14.4f}" if not is_error else ''  # 错误时 current_price 是错误消息
     change_str = f"{change_pct:>+8.2f}%"
+    quote = formatted_symbol.partition('/')[2] or 'USDT'  # 计价币
     
     if is_invalid:
-        line = f"[{timestamp:<{ts_width}}] [{ex_display}] {formatted_symbol:<{sym_width}} | 价格: {price_str:<{price_width}} USDT (无效) | 变化: {change_str:<{change_width}}"
+        line = f"[{timestamp:<{ts_width}}] [{ex_display}] {formatted_symbol:<{sym_width}} | 价格: {price_str:<{price_width}} {quote} (无效) | 变化: {change_str:<{change_width}}"
         print_colored(line, 'yellow')
     elif is_alert:
-        line = f"[{timestamp:<{ts_width}}] [{ex_display}] {formatted_symbol:<{sym_width}} | 价格: {price_str:<{price_width}} USDT | 变化: {change_str:<{change_width}}"
+        line = f"[{timestamp:<{ts_width}}] [{ex_display}] {formatted_symbol:<{sym_width}} | 价格: {price_str:<{price_width}} {quote} | 变化: {change_str:<{change_width}}"
         print_colored(line, 'red')
     elif is_error:
         error_msg = f"错误: {current_price}"  # current_price 这里是 error msg
         # 对于错误，简化对齐，使用固定宽
         line = f"[{timestamp:<{ts_width}}] [{ex_display}] {formatted_symbol:<{sym_width}} | {error_msg:<{price_width + change_width + 8}}"
-        print(line)
+        _emit(line)
     else:
-        line = f"[{timestamp:<{ts_width}}] [{ex_display}] {formatted_symbol:<{sym_width}} | 价格: {price_str:<{price_width}} USDT | 变化: {change_str:<{change_width}}"
-        print(line)
+        line = f"[{timestamp:<{ts_width}}] [{ex_display}] {formatted_symbol:<{sym_width}} | 价格: {price_str:<{price_width}} {quote} | 变化: {change_str:<{change_width}}"
+        _emit(line)
 
-def get_price(exchange, symbol):
+class DashboardRenderer:
     """
-    使用指定交易所API获取价格。
-    :param exchange: 交易所名称，如 'binance'
-    :param symbol: 币种符号，如 'BTCUSDT'
-    :return: (价格float, 错误消息) 或 (None, None) 如果成功
+    原地刷新的终端仪表盘：固定的 币种 × 交易所 表格。
+    只重绘内容变化的单元格（光标定位），每帧一次缓冲写出；
+    后台线程按 fps 上限刷新，与数据到达速度无关。
     """
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-    
-    try:
-        if exchange == '币安':
-            url = f"https://api.binance.com/api/v3/ticker/price?symbol={symbol}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                price = float(data.get('price', 0))
-                return price, None
-            else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
-        elif exchange == 'okx':
-            formatted_sym = symbol[:-4] + '-' + symbol[-4:]
-            url = f"https://www.okx.com/api/v5/market/ticker?instId={formatted_sym}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('data') and len(data['data']) > 0:
-                    price = float(data['data'][0].get('last', 0))
-                    return price, None
-                else:
-                    return None, "无数据"
-            else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
-        elif exchange == '芝麻开门':
-            formatted_sym = symbol[:-4] + '_' + symbol[-4:]
-            url = f"https://api.gateio.ws/api/v4/spot/tickers?currency_pair={formatted_sym}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                if data and len(data) > 0:
-                    price = float(data[0].get('last', 0))
-                    return price, None
-                else:
-                    return None, "无数据"
-            else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
-        elif exchange == 'bitget':
-            url = f"https://api.bitget.com/api/v2/spot/market/tickers?symbol={symbol}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('data') and len(data['data']) > 0:
-                    # 修复：Bitget 字段是 'lastPr'，不是 'lastPrice'
-                    price = float(data['data'][0].get('lastPr', 0))
-                    return price, None
-                else:
-                    return None, "无数据"
-            else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
-        elif exchange == '库币':
-            formatted_sym = symbol[:-4] + '-' + symbol[-4:]
-            url = f"https://api.kucoin.com/api/v1/market/stats?symbol={formatted_sym}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('data'):
-                    price = float(data['data'].get('last', 0))
-                    return price, None
-                else:
-                    return None, "无数据"
-            else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
-        elif exchange == '抹茶':
-            url = f"https://api.mexc.com/api/v3/ticker/price?symbol={symbol}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                price = float(data.get('price', 0))
-                return price, None
+
+    PRICE_CELL_WIDTH = 23  # "      100000.0000  +0.12%"
+    GAP_CELL_WIDTH = 10
+    MESSAGE_LINES = 6
+
+    def __init__(self, formatted_symbols, exchanges, fps=5, show_gap=False, out=None):
+        self.out = out or sys.stdout
+        self.fps = max(0.5, float(fps))
+        # 列宽只在启动时计算一次
+        self.sym_width = max([10] + [display_width(s) for s in formatted_symbols])
+        self.cell_widths = [max(self.PRICE_CELL_WIDTH, display_width(ex.upper())) for ex in exchanges]
+        self.rows = {s: 3 + i for i, s in enumerate(formatted_symbols)}  # 第1行标题，第2行表头
+        self.cols = {}
+        col = self.sym_width + 2
+        for ex, width in zip(exchanges, self.cell_widths):
+            self.cols[ex] = (col, width)
+            col += width + 3
+        self.gap_col = (col, self.GAP_CELL_WIDTH) if show_gap else None
+        self.message_row = 4 + len(formatted_symbols)
+        self.bottom_row = self.message_row + self.MESSAGE_LINES
+        self.messages = collections.deque(maxlen=self.MESSAGE_LINES)
+        self._drawn = {}  # dict: (row, col) -> (text, color) 屏幕上已有内容
+        self._dirty = {}  # dict: (row, col) -> (text, color) 待重绘
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._header = self._build_header(exchanges)
+
+    def _build_header(self, exchanges):
+        parts = [pad_display('币种', self.sym_width)]
+        for ex, width in zip(exchanges, self.cell_widths):
+            parts.append(pad_display(ex.upper(), width))
+        if self.gap_col:
+            parts.append(pad_display('差距', self.GAP_CELL_WIDTH))
+        return ' | '.join(parts)
+
+    def _set(self, row, col, text, color=''):
+        cell = (text, color)
+        with self._lock:
+            if self._drawn.get((row, col)) != cell:
+                self._dirty[(row, col)] = cell
             else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
-        elif exchange == '火币':
-            formatted_sym = symbol.lower()
-            url = f"https://api.huobi.pro/market/detail/merged?symbol={formatted_sym}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('tick'):
-                    price = float(data['tick'].get('close', 0))
-                    return price, None
-                else:
-                    return None, "无数据"
+                self._dirty.pop((row, col), None)
+
+    def set_price(self, exchange, formatted_symbol, current_price, change_pct, is_alert=False, is_invalid=False, is_error=False):
+        row = self.rows.get(formatted_symbol)
+        if row is None or exchange not in self.cols:
+            return
+        col, width = self.cols[exchange]
+        if is_error:
+            text, color = pad_display(f"错误: {current_price}", width), 'yellow'
+        else:
+            text = pad_display(f"{current_price:>14.4f} {change_pct:>+7.2f}%", width)
+            color = 'yellow' if is_invalid else 'red' if is_alert else ''
+        self._set(row, col, text, color)
+
+    def set_gap(self, formatted_symbol, gap_pct, is_alert=False):
+        row = self.rows.get(formatted_symbol)
+        if row is None or self.gap_col is None:
+            return
+        col, width = self.gap_col
+        self._set(row, col, pad_display(f"{gap_pct:>8.2f}%", width), 'red' if is_alert else '')
+
+    def add_message(self, text, color=''):
+        """消息区保留最近几条报警/提示"""
+        self.messages.append((time.strftime("%H:%M:%S") + ' ' + text.replace('\n', ' '), color))
+        width = shutil.get_terminal_size((120, 30)).columns - 1
+        for i, (line, line_color) in enumerate(self.messages):
+            self._set(self.message_row + i, 1, pad_display(line, width), line_color)
+
+    def start(self):
+        """清屏、绘制静态表头与币种列，启动刷新线程"""
+        buf = ['\033[?25l\033[2J\033[H', '监控仪表盘（Ctrl+C 停止）',
+               f"\033[2;1H{self._header}"]
+        for symbol, row in self.rows.items():
+            buf.append(f"\033[{row};1H{pad_display(symbol, self.sym_width)} |")
+        self.out.write(''.join(buf))
+        self.out.flush()
+        self._thread = threading.Thread(target=self._run, name='dashboard', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        frame_interval = 1.0 / self.fps
+        while not self._stop.wait(frame_interval):
+            self.render()
+
+    def render(self):
+        """输出一帧：只包含变化的单元格，一次写出；没有变化则不输出"""
+        start = time.perf_counter()
+        self._set(1, 30, time.strftime('%Y-%m-%d %H:%M:%S'))
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._drawn.update(dirty)
+        if not dirty:
+            return
+        buf = []
+        for (row, col), (text, color) in dirty.items():
+            if color:
+                buf.append(f"\033[{row};{col}H{ANSI_COLORS[color]}{text}{ANSI_COLORS['end']}")
             else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
-        elif exchange == 'bybit':
-            url = f"https://api.bybit.com/v5/market/tickers?category=spot&symbol={symbol}"
-            response = requests.get(url, headers=headers, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('result', {}).get('list') and len(data['result']['list']) > 0:
-                    price = float(data['result']['list'][0].get('lastPrice', 0))
-                    return price, None
-                else:
-                    return None, "无数据"
+                buf.append(f"\033[{row};{col}H{text}")
+        buf.append(f"\033[{self.bottom_row};1H")
+        self.out.write(''.join(buf))
+        self.out.flush()
+        metrics.observe_phase('render', time.perf_counter() - start)
+
+    def close(self):
+        """停止刷新并恢复光标"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self.render()
+        self.out.write(f"\033[{self.bottom_row};1H\033[?25h\n")
+        self.out.flush()
+
+def configure_http(config):
+    """从配置读取连接池大小和各交易所连接/读取超时"""
+    http_settings['pool_size'] = config.get('http_pool_size', 16)
+    http_settings['connect_timeout'] = config.get('connect_timeout', 3.0)
+    http_settings['read_timeout'] = config.get('read_timeout', 5.0)
+    http_settings['exchange_timeouts'] = config.get('exchange_timeouts') or {}
+    http_settings['adaptive_timeout'] = config.get('adaptive_timeout', True)
+    http_settings['timeout_p99_multiplier'] = config.get('timeout_p99_multiplier', 3.0)
+    http_settings['min_read_timeout'] = config.get('min_read_timeout', 1.0)
+    http_settings['hedge_delay'] = config.get('hedge_delay', 'auto')
+    breaker_settings['failures'] = config.get('breaker_failures', 5)
+    breaker_settings['cooldown'] = config.get('breaker_cooldown', 5.0)
+    breaker_settings['max_cooldown'] = config.get('breaker_max_cooldown', 300.0)
+    circuit_breakers.clear()
+
+def get_session(exchange):
+    """获取交易所的长连接 Session（首次使用时创建）"""
+    session = _sessions.get(exchange)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(exchange)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(REQUEST_HEADERS)
+                pool_size = http_settings['pool_size']
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[exchange] = session
+    return session
+
+def get_timeout(exchange):
+    """返回交易所的 (连接超时, 读取超时)"""
+    custom = http_settings['exchange_timeouts'].get(exchange)
+    if custom:
+        return tuple(custom)
+    return (http_settings['connect_timeout'], http_settings['read_timeout'])
+
+def connection_stats():
+    """
+    统计各交易所连接复用情况。
+    :return: dict: exchange -> (请求数, 新建连接数, 复用次数)
+    """
+    stats = {}
+    for exchange, session in list(_sessions.items()):
+        adapter = session.get_adapter('https://')
+        num_requests = num_connections = 0
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+        stats[exchange] = (num_requests, num_connections, max(0, num_requests - num_connections))
+    return stats
+
+def print_connection_stats():
+    """打印连接复用统计"""
+    parts = [f"{ex.upper()} {req}次/新建{conn}/复用{reused}" for ex, (req, conn, reused) in connection_stats().items()]
+    if parts:
+        print_colored(f"连接统计: {' | '.join(parts)}", 'blue')
+
+def prewarm_sessions(connections_per_exchange):
+    """
+    预先建立连接，避免第一轮 tick 承担握手耗时。
+    :param connections_per_exchange: dict: exchange -> 需要预热的并发连接数
+    :return: 成功建立的连接数
+    """
+    results = []
+    threads = []
+    for exchange, count in connections_per_exchange.items():
+        adapter = EXCHANGE_ADAPTERS.get(exchange)
+        if adapter is None or not adapter.ping_path:
+            continue
+        args = (get_session(exchange), adapter.url(adapter.ping_path), get_timeout(exchange), results)
+        for _ in range(max(1, min(count, http_settings['pool_size']))):
+            threads.append(threading.Thread(target=_ping, args=args, name='prewarm', daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(results)
+
+def _ping(session, url, timeout, results):
+    try:
+        session.get(url, timeout=timeout)
+        results.append(True)
+    except Exception:
+        results.append(False)
+
+def start_prewarm(connections_per_exchange):
+    """在后台线程预热连接，与启动的其余步骤并行，不阻塞第一轮 tick"""
+    def run():
+        start = time.monotonic()
+        warmed = prewarm_sessions(connections_per_exchange)
+        print_colored(f"连接预热完成: {warmed} 个连接，耗时 {(time.monotonic() - start) * 1000:.0f}ms", 'blue')
+
+    threading.Thread(target=run, name='prewarm', daemon=True).start()
+
+# ---------------- 运行指标 ----------------
+# 常驻开启：每次记录只是一次加锁计数（微秒级），采集端点按需汇总。
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 秒
+RECENT_SAMPLES = 512  # 每个交易所保留最近多少次请求耗时，用于计算 p50/p99
+
+class LatencyHistogram:
+    """固定分桶直方图（Prometheus histogram），另保留最近若干样本计算分位数"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.total = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def quantile(self, q):
+        """最近样本的分位数（秒），没有样本时返回 None"""
+        samples = sorted(self.recent)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+class Metrics:
+    """
+    请求耗时、错误计数、价格时效和 tick 各阶段耗时。
+    请求耗时按 (交易所, 请求类型 single/batch) 统计，错误按 (交易所, 类型) 计数，
+    价格时效记录每个 (symbol, exchange) 最近一次收到价格的时间。
+    """
+
+    PHASES = ('fetch', 'alerts', 'render')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # dict: (exchange, kind) -> LatencyHistogram
+        self.errors = collections.Counter()  # (exchange, error_type) -> 次数
+        self.hedged = collections.Counter()  # exchange -> 对冲请求次数
+        self.price_times = {}  # dict: (symbol, exchange) -> 最近收到价格的 time.time()
+        self.phases = {phase: LatencyHistogram() for phase in self.PHASES}
+        self.alerts = collections.Counter()  # 报警事件: queued 入队 / coalesced 合并 / dropped 队列满丢弃 / delivered 已分发
+        self.sink_errors = collections.Counter()  # sink 名 -> 输出失败次数
+        self.dispatch = LatencyHistogram()  # 报警从入队到所有输出端完成的耗时
+        self._render = threading.local()  # 每个线程各自累计的滚动日志输出耗时（主循环在 process_results 中取走）
+        self.forwarded = None  # 分片工作进程中为 list：新增的请求耗时/错误/对冲记录，定期交给协调进程汇总
+        self.ticks = 0
+        self.started = time.time()
+
+    def observe_request(self, exchange, kind, seconds):
+        with self._lock:
+            histogram = self.requests.get((exchange, kind))
+            if histogram is None:
+                histogram = self.requests[(exchange, kind)] = LatencyHistogram()
+            histogram.observe(seconds)
+            if self.forwarded is not None:
+                self.forwarded.append(('request', exchange, kind, seconds))
+
+    def count_error(self, exchange, error_type, n=1):
+        with self._lock:
+            self.errors[(exchange, error_type)] += n
+            if self.forwarded is not None:
+                self.forwarded.append(('error', exchange, error_type, n))
+
+    def count_hedge(self, exchange):
+        with self._lock:
+            self.hedged[exchange] += 1
+            if self.forwarded is not None:
+                self.forwarded.append(('hedge', exchange))
+
+    def take_forwarded(self):
+        """取走上次以来新增的记录（分片工作进程）"""
+        with self._lock:
+            records, self.forwarded = self.forwarded, []
+        return records
+
+    def merge_forwarded(self, records):
+        """汇总工作进程交来的记录（协调进程）"""
+        for record in records:
+            if record[0] == 'request':
+                self.observe_request(*record[1:])
+            elif record[0] == 'error':
+                self.count_error(*record[1:])
+            elif record[0] == 'hedge':
+                self.count_hedge(*record[1:])
+
+    def mark_price(self, key, when=None):
+        self.price_times[key] = when or time.time()
+
+    def count_alert(self, event, n=1):
+        with self._lock:
+            self.alerts[event] += n
+
+    def count_sink_error(self, sink):
+        with self._lock:
+            self.sink_errors[sink] += 1
+
+    def observe_dispatch(self, seconds):
+        with self._lock:
+            self.dispatch.observe(seconds)
+
+    def observe_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase].observe(seconds)
+
+    def add_render_seconds(self, seconds):
+        self._render.seconds = getattr(self._render, 'seconds', 0.0) + seconds
+
+    def take_render_seconds(self):
+        """取走当前线程累计的输出耗时；报警分发线程的输出计入 dispatch 耗时，不影响主循环的阶段统计"""
+        seconds = getattr(self._render, 'seconds', 0.0)
+        self._render.seconds = 0.0
+        return seconds
+
+    def tick_done(self):
+        self.ticks += 1
+
+    def exchange_latency(self, exchange, q, min_samples=1):
+        """交易所最近请求耗时的分位数（秒，合并 single/batch），样本少于 min_samples 时返回 None"""
+        with self._lock:
+            samples = sorted(s for (ex, _), h in self.requests.items() if ex == exchange for s in h.recent)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def price_ages(self, now=None):
+        """dict: (symbol, exchange) -> 价格时效（秒）"""
+        now = now or time.time()
+        return {key: now - ts for key, ts in list(self.price_times.items())}
+
+    def prometheus(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            requests_snapshot = {key: (h.buckets, list(h.counts), h.total, h.count) for key, h in self.requests.items()}
+            phases_snapshot = {key: (h.buckets, list(h.counts), h.total, h.count) for key, h in self.phases.items()}
+            errors_snapshot = dict(self.errors)
+            hedged_snapshot = dict(self.hedged)
+            alerts_snapshot = dict(self.alerts)
+            sink_errors_snapshot = dict(self.sink_errors)
+            h = self.dispatch
+            dispatch_snapshot = (h.buckets, list(h.counts), h.total, h.count)
+
+        def histogram(name, labels, snapshot):
+            buckets, counts, total, count = snapshot
+            cumulative = 0
+            for le, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {count}')
+
+        lines.append('# HELP price_monitor_request_seconds 交易所行情请求耗时')
+        lines.append('# TYPE price_monitor_request_seconds histogram')
+        for (exchange, kind), snapshot in sorted(requests_snapshot.items()):
+            histogram('price_monitor_request_seconds', f'exchange="{exchange}",kind="{kind}"', snapshot)
+        lines.append('# HELP price_monitor_errors_total 请求错误次数（按类型）')
+        lines.append('# TYPE price_monitor_errors_total counter')
+        for (exchange, error_type), n in sorted(errors_snapshot.items()):
+            lines.append(f'price_monitor_errors_total{{exchange="{exchange}",type="{error_type}"}} {n}')
+        lines.append('# HELP price_monitor_hedged_requests_total 关键币种对冲请求次数')
+        lines.append('# TYPE price_monitor_hedged_requests_total counter')
+        for exchange, n in sorted(hedged_snapshot.items()):
+            lines.append(f'price_monitor_hedged_requests_total{{exchange="{exchange}"}} {n}')
+        lines.append('# HELP price_monitor_circuit_open 熔断状态（0 正常 / 1 熔断 / 0.5 半开探测）')
+        lines.append('# TYPE price_monitor_circuit_open gauge')
+        for exchange, breaker in sorted(circuit_breakers.items()):
+            state = {CircuitBreaker.CLOSED: 0, CircuitBreaker.OPEN: 1, CircuitBreaker.HALF_OPEN: 0.5}[breaker.state]
+            lines.append(f'price_monitor_circuit_open{{exchange="{exchange}"}} {state}')
+        lines.append('# HELP price_monitor_price_age_seconds 距最近一次收到价格的秒数')
+        lines.append('# TYPE price_monitor_price_age_seconds gauge')
+        for (symbol, exchange), age in sorted(self.price_ages().items()):
+            lines.append(f'price_monitor_price_age_seconds{{symbol="{symbol}",exchange="{exchange}"}} {age:.3f}')
+        lines.append('# HELP price_monitor_tick_phase_seconds 每轮各阶段耗时（fetch 抓取 / alerts 报警计算 / render 输出）')
+        lines.append('# TYPE price_monitor_tick_phase_seconds histogram')
+        for phase, snapshot in phases_snapshot.items():
+            histogram('price_monitor_tick_phase_seconds', f'phase="{phase}"', snapshot)
+        lines.append('# HELP price_monitor_alerts_total 报警事件数（queued 入队 / coalesced 合并 / dropped 丢弃 / delivered 已分发）')
+        lines.append('# TYPE price_monitor_alerts_total counter')
+        for event, n in sorted(alerts_snapshot.items()):
+            lines.append(f'price_monitor_alerts_total{{event="{event}"}} {n}')
+        lines.append('# HELP price_monitor_alert_sink_errors_total 报警输出端失败次数')
+        lines.append('# TYPE price_monitor_alert_sink_errors_total counter')
+        for sink, n in sorted(sink_errors_snapshot.items()):
+            lines.append(f'price_monitor_alert_sink_errors_total{{sink="{sink}"}} {n}')
+        if alert_dispatcher is not None:
+            lines.append('# HELP price_monitor_alert_queue_depth 等待分发的报警数')
+            lines.append('# TYPE price_monitor_alert_queue_depth gauge')
+            lines.append(f'price_monitor_alert_queue_depth {alert_dispatcher.depth()}')
+        lines.append('# HELP price_monitor_alert_dispatch_seconds 报警从入队到分发完成的耗时')
+        lines.append('# TYPE price_monitor_alert_dispatch_seconds histogram')
+        histogram('price_monitor_alert_dispatch_seconds', 'sink="all"', dispatch_snapshot)
+        lines.append('# TYPE price_monitor_ticks_total counter')
+        lines.append(f'price_monitor_ticks_total {self.ticks}')
+        if first_price_time is not None:
+            lines.append('# HELP price_monitor_time_to_first_price_seconds 启动到第一个价格到达的秒数')
+            lines.append('# TYPE price_monitor_time_to_first_price_seconds gauge')
+            lines.append(f'price_monitor_time_to_first_price_seconds {first_price_time:.3f}')
+        lines.append('# TYPE price_monitor_uptime_seconds gauge')
+        lines.append(f'price_monitor_uptime_seconds {time.time() - self.started:.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """一行汇总：各交易所 p50/p99 耗时、错误数、最大价格时效，以及各阶段 p50"""
+        ages = {}
+        for (_, exchange), age in self.price_ages().items():
+            ages[exchange] = max(ages.get(exchange, 0.0), age)
+        with self._lock:
+            exchanges = list(dict.fromkeys(ex for ex, _ in self.requests))
+            errors = collections.Counter()
+            for (exchange, _), n in self.errors.items():
+                errors[exchange] += n
+        parts = []
+        for exchange in exchanges:
+            p50, p99 = self.exchange_latency(exchange, 0.5), self.exchange_latency(exchange, 0.99)
+            breaker = circuit_breakers.get(exchange)
+            state = ' 熔断中' if breaker is not None and breaker.state != CircuitBreaker.CLOSED else ''
+            parts.append(f"{exchange.upper()} p50 {p50 * 1000:.0f}ms/p99 {p99 * 1000:.0f}ms 错误{errors[exchange]} "
+                         f"时效{f'{ages[exchange]:.1f}s' if exchange in ages else '-'}{state}")
+        phases = ' '.join(f"{phase} {(h.quantile(0.5) or 0) * 1000:.1f}ms" for phase, h in self.phases.items())
+        return f"指标: {' | '.join(parts) or '暂无请求'} || 阶段p50: {phases}"
+
+metrics = Metrics()
+
+def classify_error(exc):
+    """把请求异常归类为错误类型（指标标签）"""
+    if isinstance(exc, requests.Timeout):
+        return 'timeout'
+    if isinstance(exc, requests.ConnectionError):
+        return 'connection'
+    if isinstance(exc, (ValueError, KeyError, IndexError, TypeError)):
+        return 'parse'
+    return 'other'
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_reporter(interval):
+    """后台线程每 interval 秒打印一行指标汇总（0 关闭）"""
+    if not interval:
+        return
+
+    def report():
+        while True:
+            time.sleep(interval)
+            print_colored(metrics.summary(), 'blue')
+
+    threading.Thread(target=report, name='metrics-summary', daemon=True).start()
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """在后台线程启动 Prometheus 指标端点 http://host:port/metrics"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+# ---------------- 熔断与自适应超时 ----------------
+# 交易所连续失败时熔断：暂停请求，冷却后放行一个半开探测请求，探测失败则冷却时间翻倍。
+# 熔断期间该交易所的价格直接标记为过期，不再每轮每个币种都等满超时。
+
+breaker_settings = {
+    'failures': 5,  # 连续失败多少次熔断，0 关闭
+    'cooldown': 5.0,  # 首次熔断时长（秒），之后每次探测失败翻倍
+    'max_cooldown': 300.0,  # 熔断时长上限（秒）
+}
+circuit_breakers = {}  # dict: exchange -> CircuitBreaker
+
+# 不视为交易所故障的错误类型（400/404/空数据说明交易所正常响应，只是币种不存在）；
+# 其他错误（超时、连接、解析、429、5xx，以及 403/418 封禁等其他 4xx）都计入熔断
+HEALTHY_ERRORS = ('empty', 'http_400', 'http_404')
+
+class CircuitBreaker:
+    """单个交易所的熔断器：closed 正常 / open 熔断 / half_open 已放行一个探测请求"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    PROBE_TIMEOUT = 30.0  # 探测请求未回报（如被取消）超过该秒数则重新放行探测
+
+    def __init__(self, exchange, failures=5, cooldown=5.0, max_cooldown=300.0):
+        self.exchange = exchange
+        self.failure_threshold = failures
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否可以发出请求；熔断冷却结束后只放行一个探测请求"""
+        if self.state == self.CLOSED or not self.failure_threshold:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.OPEN and now >= self.open_until:
+                self.state = self.HALF_OPEN
+                self.probe_started = now
+                return True
+            if self.state == self.HALF_OPEN and now - self.probe_started > self.PROBE_TIMEOUT:
+                self.probe_started = now
+                return True
+            return self.state == self.CLOSED
+
+    def release_probe(self):
+        """放行的探测请求最终没有发出（如本轮限流），允许下次重新探测"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probe_started = 0.0
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            recovered = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+        if recovered:
+            print_colored(f"✅ [{self.exchange.upper()}] 探测成功，恢复请求", 'green')
+
+    def record_failure(self):
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                message = f"⚠️ [{self.exchange.upper()}] 探测失败，继续熔断 {self.cooldown:.0f}s"
+            elif self.state == self.CLOSED:
+                self.failures += 1
+                if self.failures < self.failure_threshold:
+                    return
+                message = f"⚠️ [{self.exchange.upper()}] 连续失败 {self.failures} 次，熔断 {self.cooldown:.0f}s 后探测"
             else:
-                return None, f"请求失败，状态码: {response.status_code}"
-        
+                return  # 熔断前已在途的请求
+            self.state = self.OPEN
+            self.open_until = time.monotonic() + self.cooldown
+        print_colored(message, 'yellow')
+
+def get_breaker(exchange):
+    breaker = circuit_breakers.get(exchange)
+    if breaker is None:
+        breaker = circuit_breakers.setdefault(exchange, CircuitBreaker(exchange, **breaker_settings))
+    return breaker
+
+def report_outcome(exchange, error_type=None):
+    """记录一次请求结果：错误计数 + 熔断器状态（error_type 为 None 表示成功）"""
+    if error_type:
+        metrics.count_error(exchange, error_type)
+    if error_type is None or error_type in HEALTHY_ERRORS:
+        get_breaker(exchange).record_success()
+    else:
+        get_breaker(exchange).record_failure()
+
+def adaptive_timeout(exchange):
+    """
+    按交易所近期 p99 耗时收紧读取超时：p99 × timeout_p99_multiplier，
+    不低于 min_read_timeout，不高于配置的读取超时；样本不足时使用配置值。
+    """
+    connect, read = get_timeout(exchange)
+    if not http_settings['adaptive_timeout']:
+        return (connect, read)
+    p99 = metrics.exchange_latency(exchange, 0.99, min_samples=20)
+    if p99 is None:
+        return (connect, read)
+    return (connect, min(read, max(http_settings['min_read_timeout'], p99 * http_settings['timeout_p99_multiplier'])))
+
+def hedge_delay(exchange):
+    """关键币种请求多久未返回时发出对冲请求：配置秒数，或 'auto' 取近期 p90 耗时"""
+    delay = http_settings['hedge_delay']
+    if delay != 'auto':
+        return float(delay)
+    p90 = metrics.exchange_latency(exchange, 0.9, min_samples=20)
+    return max(0.05, p90) if p90 is not None else http_settings['read_timeout'] / 4
+
+# ---------------- 交易所适配器 ----------------
+# 每个交易所以适配器声明：原生符号映射、URL 模板、响应字段提取；
+# 新增交易所只需注册一个适配器，主循环无需改动。
+
+@dataclass
+class ExchangeAdapter:
+    name: str
+    base_url: str
+    price_path: str  # 单币种行情路径模板，{symbol} 为交易所原生符号
+    extract_price: Callable  # 响应 JSON -> 价格float，无数据返回 None
+    to_native: Callable = lambda s: s  # 配置符号（如 'BTCUSDT'）-> 交易所原生符号
+    batch_path: str = None  # 全量行情路径（一次返回全部现货交易对），None 表示不支持
+    extract_batch: Callable = None  # 全量响应 JSON -> [(原生符号, 价格), ...]
+    ping_path: str = None  # 轻量连通性接口（服务器时间 / ping）
+    instruments_path: str = None  # 交易对列表路径（交易对发现），None 表示不支持
+    extract_instruments: Callable = None  # 交易对列表响应 JSON -> [(原生符号, 基础币, 计价币), ...]（只含可交易的）
+    stream: dict = None  # WebSocket 推送协议，None 表示不支持推送
+    rate_limit: float = 10.0  # 公共行情接口限频（请求/秒，保守取值），可被配置 rate_limits 覆盖
+
+    def url(self, path):
+        return self.base_url + path
+
+EXCHANGE_ADAPTERS = {}  # dict: exchange -> ExchangeAdapter（按注册顺序）
+
+# 常见计价币（从长到短匹配后缀），交易对列表未加载时用来拆分 'BTCUSDT' 这类无分隔符号
+KNOWN_QUOTES = sorted(('USDT', 'USDC', 'FDUSD', 'TUSD', 'BUSD', 'DAI', 'USD', 'EUR', 'TRY', 'BRL', 'BTC', 'ETH', 'BNB'),
+                      key=len, reverse=True)
+
+def split_symbol(symbol):
+    """配置符号 -> (基础币, 计价币)：优先用已发现的交易对索引，其次按常见计价币后缀拆分，都不匹配时计价币为空"""
+    pair = symbol_universe.pairs.get(symbol)
+    if pair is not None:
+        return pair
+    for quote in KNOWN_QUOTES:
+        if symbol.endswith(quote) and len(symbol) > len(quote):
+            return symbol[:-len(quote)], quote
+    return symbol, ''
+
+def _joined(separator):
+    """原生符号为 基础币{separator}计价币 的交易所（如 OKX 'BTC-USDT'）"""
+    return lambda s: separator.join(part for part in split_symbol(s) if part)
+
+def register_adapter(adapter):
+    """注册交易所适配器"""
+    EXCHANGE_ADAPTERS[adapter.name] = adapter
+    return adapter
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _kucoin_stream_url():
+    """库币推送需先申请临时 token 和推送服务器地址"""
+    response = get_session('库币').post("https://api.kucoin.com/api/v1/bullet-public", timeout=get_timeout('库币'))
+    data = response.json()['data']
+    server = data['instanceServers'][0]
+    return f"{server['endpoint']}?token={data['token']}&connectId={int(time.time() * 1000)}"
+
+# WebSocket 推送协议（stream）：
+#   url: 默认推送地址（可被配置 stream_urls 覆盖），可为返回地址的函数
+#   subscribe: 原生符号列表 -> 订阅消息列表
+#   parse: 已解码的消息 -> [(原生符号, 价格), ...]
+#   reply: 需要应答的服务端消息（如火币 ping）-> 应答消息，可选
+#   ping: (应用层心跳消息, 间隔秒)，可选
+# 抹茶 v3 推送为 protobuf 格式，不声明 stream，推送模式下对其回退为 REST 轮询。
+
+register_adapter(ExchangeAdapter(
+    name='币安',
+    base_url="https://api.binance.com",
+    price_path="/api/v3/ticker/price?symbol={symbol}",
+    extract_price=lambda d: float(d.get('price', 0)),
+    batch_path="/api/v3/ticker/price",
+    extract_batch=lambda d: ((t['symbol'], t['price']) for t in d),
+    ping_path="/api/v3/ping",
+    instruments_path="/api/v3/exchangeInfo",
+    extract_instruments=lambda d: [(t['symbol'], t['baseAsset'], t['quoteAsset']) for t in d.get('symbols') or []
+                                   if t.get('status') == 'TRADING'],
+    stream={
+        'url': "wss://stream.binance.com:9443/ws",
+        'subscribe': lambda syms: [json.dumps({"method": "SUBSCRIBE", "params": [f"{s.lower()}@miniTicker" for s in chunk], "id": i + 1})
+                                   for i, chunk in enumerate(_chunks(syms, 200))],
+        'parse': lambda d: [(d['s'], float(d['c']))] if d.get('e') == '24hrMiniTicker' else [],
+    },
+))
+
+register_adapter(ExchangeAdapter(
+    name='okx',
+    base_url="https://www.okx.com",
+    price_path="/api/v5/market/ticker?instId={symbol}",
+    extract_price=lambda d: float(d['data'][0].get('last', 0)) if d.get('data') else None,
+    to_native=_joined('-'),
+    batch_path="/api/v5/market/tickers?instType=SPOT",
+    extract_batch=lambda d: ((t['instId'], t['last']) for t in d.get('data') or []),
+    ping_path="/api/v5/public/time",
+    instruments_path="/api/v5/public/instruments?instType=SPOT",
+    extract_instruments=lambda d: [(t['instId'], t['baseCcy'], t['quoteCcy']) for t in d.get('data') or []
+                                   if t.get('state') == 'live'],
+    stream={
+        'url': "wss://ws.okx.com:8443/ws/v5/public",
+        'subscribe': lambda syms: [json.dumps({"op": "subscribe", "args": [{"channel": "tickers", "instId": s} for s in syms]})],
+        'parse': lambda d: [(t['instId'], float(t['last'])) for t in d.get('data') or []],
+        'ping': ("ping", 25),
+    },
+))
+
+register_adapter(ExchangeAdapter(
+    name='芝麻开门',
+    rate_limit=20.0,
+    base_url="https://api.gateio.ws",
+    price_path="/api/v4/spot/tickers?currency_pair={symbol}",
+    extract_price=lambda d: float(d[0].get('last', 0)) if d else None,
+    to_native=_joined('_'),
+    batch_path="/api/v4/spot/tickers",
+    extract_batch=lambda d: ((t['currency_pair'], t['last']) for t in d),
+    ping_path="/api/v4/spot/time",
+    instruments_path="/api/v4/spot/currency_pairs",
+    extract_instruments=lambda d: [(t['id'], t['base'], t['quote']) for t in d if t.get('trade_status') == 'tradable'],
+    stream={
+        'url': "wss://api.gateio.ws/ws/v4/",
+        'subscribe': lambda syms: [json.dumps({"time": int(time.time()), "channel": "spot.tickers", "event": "subscribe", "payload": syms})],
+        'parse': lambda d: [(d['result']['currency_pair'], float(d['result']['last']))]
+                           if d.get('event') == 'update' and isinstance(d.get('result'), dict) else [],
+    },
+))
+
+register_adapter(ExchangeAdapter(
+    name='bitget',
+    rate_limit=20.0,
+    base_url="https://api.bitget.com",
+    price_path="/api/v2/spot/market/tickers?symbol={symbol}",
+    extract_price=lambda d: float(d['data'][0].get('lastPr', 0)) if d.get('data') else None,  # Bitget 字段是 'lastPr'，不是 'lastPrice'
+    batch_path="/api/v2/spot/market/tickers",
+    extract_batch=lambda d: ((t['symbol'], t['lastPr']) for t in d.get('data') or []),
+    ping_path="/api/v2/public/time",
+    instruments_path="/api/v2/spot/public/symbols",
+    extract_instruments=lambda d: [(t['symbol'], t['baseCoin'], t['quoteCoin']) for t in d.get('data') or []
+                                   if t.get('status') == 'online'],
+    stream={
+        'url': "wss://ws.bitget.com/v2/ws/public",
+        'subscribe': lambda syms: [json.dumps({"op": "subscribe", "args": [{"instType": "SPOT", "channel": "ticker", "instId": s} for s in chunk]})
+                                   for chunk in _chunks(syms, 50)],
+        'parse': lambda d: [(t['instId'], float(t['lastPr'])) for t in d.get('data') or []],
+        'ping': ("ping", 30),
+    },
+))
+
+register_adapter(ExchangeAdapter(
+    name='库币',
+    base_url="https://api.kucoin.com",
+    price_path="/api/v1/market/stats?symbol={symbol}",
+    extract_price=lambda d: float(d['data'].get('last', 0)) if d.get('data') else None,
+    to_native=_joined('-'),
+    batch_path="/api/v1/market/allTickers",
+    extract_batch=lambda d: ((t['symbol'], t['last']) for t in (d.get('data') or {}).get('ticker') or []),
+    ping_path="/api/v1/timestamp",
+    instruments_path="/api/v2/symbols",
+    extract_instruments=lambda d: [(t['symbol'], t['baseCurrency'], t['quoteCurrency']) for t in d.get('data') or []
+                                   if t.get('enableTrading')],
+    stream={
+        'url': _kucoin_stream_url,
+        'subscribe': lambda syms: [json.dumps({"id": str(i + 1), "type": "subscribe", "topic": "/market/ticker:" + ','.join(chunk),
+                                               "privateChannel": False, "response": True})
+                                   for i, chunk in enumerate(_chunks(syms, 100))],
+        'parse': lambda d: [(d['topic'].split(':', 1)[1], float(d['data']['price']))] if d.get('type') == 'message' else [],
+        'ping': (json.dumps({"id": "ping", "type": "ping"}), 18),
+    },
+))
+
+register_adapter(ExchangeAdapter(
+    name='抹茶',
+    rate_limit=20.0,
+    base_url="https://api.mexc.com",
+    price_path="/api/v3/ticker/price?symbol={symbol}",
+    extract_price=lambda d: float(d.get('price', 0)),
+    batch_path="/api/v3/ticker/price",
+    extract_batch=lambda d: ((t['symbol'], t['price']) for t in d),
+    ping_path="/api/v3/ping",
+    instruments_path="/api/v3/exchangeInfo",
+    extract_instruments=lambda d: [(t['symbol'], t['baseAsset'], t['quoteAsset']) for t in d.get('symbols') or []
+                                   if str(t.get('status')) in ('1', 'ENABLED')],  # 抹茶 '1' 为可交易
+))
+
+register_adapter(ExchangeAdapter(
+    name='火币',
+    base_url="https://api.huobi.pro",
+    price_path="/market/detail/merged?symbol={symbol}",
+    extract_price=lambda d: float(d['tick'].get('close', 0)) if d.get('tick') else None,
+    to_native=lambda s: s.lower(),
+    batch_path="/market/tickers",
+    extract_batch=lambda d: ((t['symbol'], t['close']) for t in d.get('data') or []),
+    ping_path="/v1/common/timestamp",
+    instruments_path="/v1/common/symbols",
+    extract_instruments=lambda d: [(t['symbol'], t['base-currency'], t['quote-currency']) for t in d.get('data') or []
+                                   if t.get('state') == 'online'],
+    stream={
+        'url': "wss://api.huobi.pro/ws",
+        'subscribe': lambda syms: [json.dumps({"sub": f"market.{s}.ticker", "id": s}) for s in syms],
+        'parse': lambda d: [(d['ch'].split('.')[1], float(d['tick']['close']))] if d.get('tick') and d.get('ch') else [],
+        'reply': lambda d: json.dumps({"pong": d['ping']}) if 'ping' in d else None,
+    },
+))
+
+register_adapter(ExchangeAdapter(
+    name='bybit',
+    base_url="https://api.bybit.com",
+    price_path="/v5/market/tickers?category=spot&symbol={symbol}",
+    extract_price=lambda d: float(d['result']['list'][0].get('lastPrice', 0)) if d.get('result', {}).get('list') else None,
+    batch_path="/v5/market/tickers?category=spot",
+    extract_batch=lambda d: ((t['symbol'], t['lastPrice']) for t in (d.get('result') or {}).get('list') or []),
+    ping_path="/v5/market/time",
+    instruments_path="/v5/market/instruments-info?category=spot",
+    extract_instruments=lambda d: [(t['symbol'], t['baseCoin'], t['quoteCoin']) for t in (d.get('result') or {}).get('list') or []
+                                   if t.get('status') == 'Trading'],
+    stream={
+        'url': "wss://stream.bybit.com/v5/public/spot",
+        'subscribe': lambda syms: [json.dumps({"op": "subscribe", "args": [f"tickers.{s}" for s in chunk]}) for chunk in _chunks(syms, 10)],
+        'parse': lambda d: [(d['data']['symbol'], float(d['data']['lastPrice']))] if str(d.get('topic', '')).startswith('tickers.') else [],
+        'ping': (json.dumps({"op": "ping"}), 20),
+    },
+))
+
+# ---------------- 交易对发现 ----------------
+# 启动时加载各交易所的交易对列表（磁盘缓存，超过 TTL 才重新请求），建立 (基础币, 计价币) -> 原生符号索引。
+# 交易所未上架的币种在第一轮之前就从轮询计划中剔除，不再每轮浪费一次请求（甚至一次超时）；
+# 后台线程定期刷新列表，新上架/下架的币种在下一轮生效。
+
+class SymbolUniverse:
+    """各交易所已上架交易对的索引，配置符号（基础币 + 计价币，如 'BTCUSDT'）-> 原生符号"""
+
+    def __init__(self):
+        self.venues = {}  # dict: exchange -> {配置符号: 原生符号}
+        self.pairs = {}  # dict: 配置符号 -> (基础币, 计价币)
+        self.updated = {}  # dict: exchange -> 列表获取时间 time.time()
+        self.version = 0  # 任一交易所的列表有变化时加一
+        self._lock = threading.Lock()
+
+    def update(self, exchange, instruments, updated=None):
+        """
+        :param instruments: [(原生符号, 基础币, 计价币), ...]
+        :return: 列表是否有变化
+        """
+        venue, pairs = {}, {}
+        for native, base, quote in instruments:
+            base, quote = base.upper(), quote.upper()
+            venue[base + quote] = native
+            pairs[base + quote] = (base, quote)
+        with self._lock:
+            changed = venue != self.venues.get(exchange)
+            self.venues[exchange] = venue
+            self.pairs.update(pairs)
+            self.updated[exchange] = updated or time.time()
+            if changed:
+                self.version += 1
+        return changed
+
+    def native(self, exchange, symbol):
+        """原生符号，该交易所列表未加载或未上架时返回 None"""
+        venue = self.venues.get(exchange)
+        return venue.get(symbol) if venue is not None else None
+
+    def is_listed(self, exchange, symbol):
+        """True 已上架 / False 未上架 / None 未知（列表未加载）"""
+        venue = self.venues.get(exchange)
+        return None if venue is None else symbol in venue
+
+symbol_universe = SymbolUniverse()
+
+def fetch_instruments(exchange):
+    """请求交易所的交易对列表 -> [(原生符号, 基础币, 计价币), ...]"""
+    adapter = EXCHANGE_ADAPTERS[exchange]
+    connect_timeout, read_timeout = get_timeout(exchange)
+    response = get_session(exchange).get(adapter.url(adapter.instruments_path),
+                                         timeout=(connect_timeout, max(read_timeout, 10.0)))  # 列表较大，放宽读取超时
+    response.raise_for_status()
+    instruments = [(str(native), str(base), str(quote)) for native, base, quote in adapter.extract_instruments(response.json())]
+    if not instruments:
+        raise ValueError("交易对列表为空")
+    return instruments
+
+def load_symbol_cache(path):
+    """dict: exchange -> {'updated': 获取时间, 'instruments': [[原生符号, 基础币, 计价币], ...]}，文件不存在或损坏时返回空"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def save_symbol_cache(path, cache):
+    """先写临时文件再替换，避免中途退出留下半个文件"""
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError as e:
+        print_colored(f"⚠️ 交易对缓存写入失败: {e}", 'yellow')
+
+def discover_symbols(exchanges, cache_file='', ttl=86400, force=False, refresh_in_background=False):
+    """
+    加载交易对列表到 symbol_universe：缓存未过期的直接使用，其余交易所并发请求。
+    请求失败时退回过期缓存；既没有列表也没有缓存的交易所不做剔除。
+    :param force: 忽略 TTL 全部重新请求（后台刷新）
+    :param refresh_in_background: 缓存已过期时先用过期缓存剔除，再在后台线程重新请求，只有没有缓存的交易所才等待请求（启动时）
+    :return: dict: exchange -> 来源 'cache' / 'expired' / 'fetched' / 'stale' / 'failed' / 'unsupported'
+    """
+    cache = load_symbol_cache(cache_file) if cache_file else {}
+    now = time.time()
+    sources, to_fetch, deferred = {}, [], []
+    for exchange in exchanges:
+        entry = cache.get(exchange)
+        if not EXCHANGE_ADAPTERS[exchange].instruments_path:
+            sources[exchange] = 'unsupported'
+        elif entry and not force and now - entry.get('updated', 0) < ttl:
+            symbol_universe.update(exchange, entry['instruments'], entry['updated'])
+            sources[exchange] = 'cache'
+        elif entry and not force and refresh_in_background:
+            symbol_universe.update(exchange, entry['instruments'], entry['updated'])
+            sources[exchange] = 'expired'
+            deferred.append(exchange)
         else:
-            return None, f"不支持的交易所: {exchange}"
-    
+            to_fetch.append(exchange)
+    if to_fetch:
+        sources.update(_fetch_symbol_lists(to_fetch, cache, cache_file, now))
+    if deferred:
+        # 前台请求（含写缓存）完成后才开始，避免两次写缓存互相覆盖
+        threading.Thread(target=discover_symbols, args=(deferred, cache_file), kwargs={'force': True},
+                         name='symbol-refresh', daemon=True).start()
+    return sources
+
+def _fetch_symbol_lists(to_fetch, cache, cache_file, now):
+    """并发请求交易对列表并写入缓存，返回各交易所来源"""
+    sources, fetched = {}, {}
+    with ThreadPoolExecutor(max_workers=len(to_fetch)) as pool:
+        futures = {exchange: pool.submit(fetch_instruments, exchange) for exchange in to_fetch}
+    for exchange, future in futures.items():
+        entry = cache.get(exchange)
+        try:
+            instruments = future.result()
+        except Exception as e:
+            if entry:
+                symbol_universe.update(exchange, entry['instruments'], entry['updated'])
+            sources[exchange] = 'stale' if entry else 'failed'
+            print_colored(f"⚠️ [{exchange.upper()}] 交易对列表获取失败: {e}，{'使用过期缓存' if entry else '不剔除未上架币种'}", 'yellow')
+            continue
+        fetched[exchange] = instruments
+        cache[exchange] = {'updated': now, 'instruments': [list(item) for item in instruments]}
+        sources[exchange] = 'fetched'
+    if cache_file and fetched:
+        save_symbol_cache(cache_file, cache)
+    # 先写缓存再更新索引：多进程分片按新列表重启工作进程时，工作进程从缓存读到的已是新列表
+    for exchange, instruments in fetched.items():
+        symbol_universe.update(exchange, instruments, now)
+    return sources
+
+def start_symbol_refresher(exchanges, cache_file, interval):
+    """后台线程每 interval 秒重新请求交易对列表（0 关闭）；轮询主循环在下一轮应用上架/下架变化"""
+    if not interval:
+        return
+
+    def refresh():
+        while True:
+            time.sleep(interval)
+            discover_symbols(exchanges, cache_file, force=True)
+
+    threading.Thread(target=refresh, name='symbol-refresh', daemon=True).start()
+
+def prune_unlisted(pairs, verbose=True):
+    """剔除交易所未上架的 (symbol, exchange)；列表未加载的交易所全部保留"""
+    kept, skipped = [], {}
+    for symbol, exchange in pairs:
+        if symbol_universe.is_listed(exchange, symbol) is False:
+            skipped.setdefault(exchange, []).append(symbol)
+        else:
+            kept.append((symbol, exchange))
+    if verbose:
+        for exchange, symbols in skipped.items():
+            print_colored(f"ℹ️ [{exchange.upper()}] 未上架，不轮询: {', '.join(format_symbol(s) for s in symbols)}", 'yellow')
+    return kept
+
+# ---------------- 请求计划 ----------------
+# 启动时按配置的 (币种, 交易所) 一次性编译：URL 预先渲染、提取函数预先解析，
+# 主循环只做 I/O 和字段提取。
+
+@dataclass
+class PlannedRequest:
+    exchange: str
+    symbol: str
+    url: str
+    extract: Callable
+    timeout: tuple
+    critical: bool = False  # 关键币种：首个请求慢时发出对冲请求
+
+@dataclass
+class BatchRequest:
+    exchange: str
+    url: str
+    extract: Callable
+    timeout: tuple
+    keys: dict  # dict: 原生符号 -> (symbol, exchange)
+    fallbacks: list  # 批量失败时回退的逐个请求 [PlannedRequest, ...]
+    critical: bool = False  # 包含关键币种
+
+@dataclass
+class RequestPlan:
+    pairs: list
+    batches: list
+    singles: list
+    unsupported: dict  # dict: (symbol, exchange) -> 错误消息
+
+def exchange_symbol(exchange, symbol):
+    """将配置中的符号（如 'BTCUSDT'）转换为交易所原生格式（如 OKX 'BTC-USDT'），优先使用交易对列表中的原生符号"""
+    return symbol_universe.native(exchange, symbol) or EXCHANGE_ADAPTERS[exchange].to_native(symbol)
+
+def build_request(exchange, symbol):
+    """为单个 (symbol, exchange) 渲染 URL 并解析出提取函数，不支持的交易所返回 None"""
+    adapter = EXCHANGE_ADAPTERS.get(exchange)
+    if adapter is None:
+        return None
+    url = adapter.url(adapter.price_path.format(symbol=exchange_symbol(exchange, symbol)))
+    return PlannedRequest(exchange, symbol, url, adapter.extract_price, get_timeout(exchange))
+
+def compile_request_plan(pairs, batch_mode=True, batch_min_symbols=2, batch_exclude=(), critical=()):
+    """
+    编译请求计划：按交易所分组，决定每个交易所走批量接口还是逐个请求。
+    配置的币种数少于 batch_min_symbols 时，批量返回的全量数据反而更大，走逐个请求。
+    :param pairs: [(symbol, exchange), ...]
+    :param critical: 关键币种集合，其请求（或包含它的批量请求）慢时发出对冲请求
+    :return: RequestPlan
+    """
+    by_exchange = {}
+    unsupported = {}
+    for symbol, exchange in pairs:
+        if exchange not in EXCHANGE_ADAPTERS:
+            unsupported[(symbol, exchange)] = f"不支持的交易所: {exchange}"
+            continue
+        by_exchange.setdefault(exchange, []).append(symbol)
+
+    batches, singles = [], []
+    for exchange, symbols in by_exchange.items():
+        adapter = EXCHANGE_ADAPTERS[exchange]
+        planned = [build_request(exchange, symbol) for symbol in symbols]
+        for request in planned:
+            request.critical = request.symbol in critical
+        if (batch_mode and adapter.batch_path and exchange not in batch_exclude
+                and len(symbols) >= batch_min_symbols):
+            keys = {exchange_symbol(exchange, symbol): (symbol, exchange) for symbol in symbols}
+            batches.append(BatchRequest(exchange, adapter.url(adapter.batch_path), adapter.extract_batch,
+                                        get_timeout(exchange), keys, planned, any(r.critical for r in planned)))
+        else:
+            singles.extend(planned)
+    return RequestPlan(list(pairs), batches, singles, unsupported)
+
+def execute_request(request, timeout=None):
+    """
+    执行预编译的单币种请求。
+    :param timeout: 覆盖预编译的超时（自适应超时）
+    :return: (价格float, 错误消息)
+    """
+    exchange = request.exchange
+    start = time.perf_counter()
+    try:
+        response = get_session(exchange).get(request.url, timeout=timeout or request.timeout)
+        metrics.observe_request(exchange, 'single', time.perf_counter() - start)
+        if response.status_code != 200:
+            report_outcome(exchange, f"http_{response.status_code}")
+            return None, f"请求失败，状态码: {response.status_code}"
+        price = request.extract(response.json())
+        if price is None:
+            report_outcome(exchange, 'empty')
+            return None, "无数据"
+        report_outcome(exchange)
+        return price, None
     except Exception as e:
+        error_type = classify_error(e)
+        if error_type == 'timeout':  # 超时耗时也计入样本，避免自适应超时越收越紧
+            metrics.observe_request(exchange, 'single', time.perf_counter() - start)
+        report_outcome(exchange, error_type)
         return None, f"网络/解析错误: {str(e)}"
 
+def execute_batch(batch, timeout=None):
+    """
+    执行预编译的全量行情请求，只解析配置中关注的符号。
+    :param timeout: 覆盖预编译的超时（自适应超时）
+    :return: (dict: (symbol, exchange) -> 价格float, 错误消息)
+    """
+    exchange = batch.exchange
+    start = time.perf_counter()
+    try:
+        response = get_session(exchange).get(batch.url, timeout=timeout or batch.timeout)
+        metrics.observe_request(exchange, 'batch', time.perf_counter() - start)
+        if response.status_code != 200:
+            report_outcome(exchange, f"http_{response.status_code}")
+            return None, f"请求失败，状态码: {response.status_code}"
+        keys = batch.keys
+        found = {}
+        count = 0
+        for native, price in batch.extract(response.json()):
+            count += 1
+            key = keys.get(native)
+            if key is not None:
+                found[key] = float(price or 0)
+        if not count:
+            report_outcome(exchange, 'empty')
+            return None, "无数据"
+        report_outcome(exchange)
+        return found, None
+    except Exception as e:
+        error_type = classify_error(e)
+        if error_type == 'timeout':
+            metrics.observe_request(exchange, 'batch', time.perf_counter() - start)
+        report_outcome(exchange, error_type)
+        return None, f"网络/解析错误: {str(e)}"
+
+def get_fetch_executor(max_workers):
+    """获取（必要时创建）全局抓取线程池，线程在各 tick 之间复用"""
+    global _fetch_executor, _fetch_executor_size
+    if _fetch_executor is None or _fetch_executor_size != max_workers:
+        if _fetch_executor is not None:
+            _fetch_executor.shutdown(wait=False)
+        _fetch_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        _fetch_executor_size = max_workers
+    return _fetch_executor
+
+def fetch_prices(plan, max_workers=16, tick_deadline=None, limiter=None):
+    """
+    按请求计划并发获取一个 tick 内所有交易对的价格。
+    tick 耗时取决于最慢的交易所，而不是所有请求耗时之和；
+    超过 tick_deadline 仍未返回的请求标记为过期，不阻塞主循环（迟到的结果直接丢弃）。
+    批量模式下每个交易所每轮只发一次全量行情请求，再从索引中查找各币种；
+    批量请求失败时本轮回退为逐个请求。
+    熔断中的交易所不发请求，价格直接标记为过期；读取超时按各交易所近期 p99 收紧；
+    关键币种的请求超过 hedge_delay 未返回时再发一份对冲请求，先返回者为准。
+    :param plan: compile_request_plan 编译的 RequestPlan
+    :param max_workers: 线程池大小（同时在途的请求数上限）
+    :param tick_deadline: 本 tick 截止时间（秒），None 表示等待全部完成
+    :param limiter: dict: exchange -> TokenBucket，配额不足的请求本轮跳过
+    :return: dict: (symbol, exchange) -> (价格float, 错误消息)
+    """
+    executor = get_fetch_executor(max_workers)
+    deadline_at = time.monotonic() + tick_deadline if tick_deadline is not None else None
+    results = {key: (None, error) for key, error in plan.unsupported.items()}
+    timeouts = {}  # dict: exchange -> 本轮超时（每轮按近期 p99 计算一次）
+
+    def admit(exchange):
+        """返回 None 表示可以发出请求，否则为跳过原因"""
+        breaker = get_breaker(exchange)
+        if not breaker.allow():
+            metrics.count_error(exchange, 'circuit_open')
+            return CIRCUIT_OPEN_ERROR
+        bucket = limiter.get(exchange) if limiter else None
+        if bucket is not None and not bucket.try_acquire():
+            breaker.release_probe()
+            metrics.count_error(exchange, 'rate_limited')
+            return RATE_LIMITED_ERROR
+        return None
+
+    futures = {}  # future -> BatchRequest 或 PlannedRequest
+    hedges = {}  # future -> 发出对冲请求的时间点（仅关键币种）
+
+    def submit(job):
+        exchange = job.exchange
+        if exchange not in timeouts:
+            timeouts[exchange] = adaptive_timeout(exchange)
+        run = execute_request if isinstance(job, PlannedRequest) else execute_batch
+        future = executor.submit(run, job, timeouts[exchange])
+        futures[future] = job
+        if job.critical:
+            hedges[future] = time.monotonic() + hedge_delay(exchange)
+        return future
+
+    for batch in plan.batches:
+        skipped = admit(batch.exchange)
+        if skipped:
+            results.update(dict.fromkeys(batch.keys.values(), (None, skipped)))
+        else:
+            submit(batch)
+    for request in plan.singles:
+        skipped = admit(request.exchange)
+        if skipped:
+            results[(request.symbol, request.exchange)] = (None, skipped)
+        else:
+            submit(request)
+
+    pending = set(futures)
+    twins = {}  # future -> 同一请求的对冲 future（双向）
+    settled = set()  # 已得出结果的请求 id(job)，对冲的另一份结果直接丢弃
+    while pending:
+        wake_at = deadline_at
+        if hedges:
+            next_hedge = min(hedges.values())
+            wake_at = next_hedge if wake_at is None else min(wake_at, next_hedge)
+        timeout = None if wake_at is None else max(0, wake_at - time.monotonic())
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done and deadline_at is not None and time.monotonic() >= deadline_at:
+            break
+        for future in done:
+            hedges.pop(future, None)
+            job = futures[future]
+            if id(job) in settled:
+                continue
+            twin = twins.pop(future, None)
+            outcome = future.result()  # 内部已捕获异常
+            if outcome[1] and twin is not None and (not twin.done() or not twin.result()[1]):
+                continue  # 对冲的另一份仍在途或已成功，以它为准
+            settled.add(id(job))
+            if twin is not None:
+                twin.cancel()
+                pending.discard(twin)
+            if isinstance(job, PlannedRequest):
+                results[(job.symbol, job.exchange)] = outcome
+                continue
+            found, error = outcome
+            if error:
+                # 批量接口不可用，本轮回退为逐个请求
+                for request in job.fallbacks:
+                    skipped = admit(request.exchange)
+                    if skipped:
+                        results[(request.symbol, request.exchange)] = (None, skipped)
+                    else:
+                        pending.add(submit(request))
+                continue
+            for key in job.keys.values():
+                price = found.get(key)
+                results[key] = (price, None) if price is not None else (None, "无数据")
+
+        # 关键币种：首个请求超过 hedge_delay 仍未返回，发出对冲请求
+        now = time.monotonic()
+        for future, hedge_at in list(hedges.items()):
+            if hedge_at > now:
+                continue
+            del hedges[future]
+            job = futures[future]
+            if future.done() or id(job) in settled or admit(job.exchange):
+                continue
+            hedge = submit(job)
+            hedges.pop(hedge, None)  # 对冲请求本身不再对冲
+            twins[future], twins[hedge] = hedge, future
+            pending.add(hedge)
+            metrics.count_hedge(job.exchange)
+
+    for future in pending:
+        future.cancel()  # 尚未开始的直接取消，已在途的让其自然结束
+    for key in plan.pairs:
+        if key not in results:
+            results[key] = (None, STALE_ERROR)
+            metrics.count_error(key[1], 'stale')
+    return results
+
+def merge_plans(plans):
+    """合并多个请求计划（本轮到期的交易所），只拼接已编译好的请求"""
+    merged = RequestPlan([], [], [], {})
+    for plan in plans:
+        merged.pairs.extend(plan.pairs)
+        merged.batches.extend(plan.batches)
+        merged.singles.extend(plan.singles)
+        merged.unsupported.update(plan.unsupported)
+    return merged
+
+# ---------------- 调度与限频 ----------------
+
+class TokenBucket:
+    """令牌桶限流：每秒补充 rate 个令牌，最多积攒 capacity 个"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n=1):
+        """尝试取出 n 个令牌，不足时返回 False（不等待）"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return True
+            return False
+
+class TickScheduler:
+    """
+    固定截止时间的 tick 调度器：第 k 次 tick 的截止时间为 start + k * period，
+    处理耗时不会累积成漂移；错过的 tick 合并为一次执行，不追赶。
+    每个交易所有独立的周期。
+    """
+
+    def __init__(self, periods, start=None):
+        start = time.monotonic() if start is None else start
+        self.periods = dict(periods)
+        self.next_due = dict.fromkeys(self.periods, start)
+        self.missed = dict.fromkeys(self.periods, 0)  # 上次到期时合并跳过的 tick 数
+
+    def wait(self):
+        """睡到最早的截止时间，返回本次到期的交易所列表"""
+        delay = min(self.next_due.values()) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self.pop_due(time.monotonic())
+
+    def pop_due(self, now):
+        """取出已到期的交易所并推进其截止时间，错过的 tick 记入 missed"""
+        due = []
+        for exchange, next_due in self.next_due.items():
+            if next_due > now:
+                continue
+            period = self.periods[exchange]
+            missed = int((now - next_due) // period)
+            self.missed[exchange] = missed
+            self.next_due[exchange] = next_due + (missed + 1) * period
+            due.append(exchange)
+        return due
+
+def tick_burst(plan):
+    """一轮最多发出的请求数：批量请求 + 逐个请求 + 批量失败时回退的逐个请求"""
+    return len(plan.batches) + len(plan.singles) + sum(len(batch.fallbacks) for batch in plan.batches)
+
+def exchange_periods(plans, interval, exchange_intervals=None, rate_limits=None):
+    """
+    计算每个交易所的轮询周期。
+    配置为 'auto' 时按限频允许的最快速度轮询；任何配置都不会快于限频。
+    :param plans: dict: exchange -> RequestPlan
+    :return: dict: exchange -> 周期（秒）
+    """
+    exchange_intervals = exchange_intervals or {}
+    rate_limits = rate_limits or {}
+    periods = {}
+    for exchange, plan in plans.items():
+        per_tick = len(plan.batches) + len(plan.singles)
+        rate = rate_limits.get(exchange)
+        min_period = per_tick / rate if rate else 0
+        configured = exchange_intervals.get(exchange, interval)
+        if configured == 'auto':
+            periods[exchange] = min_period or interval
+        else:
+            periods[exchange] = max(float(configured), min_period)
+    return periods
+
+# ---------------- 价格历史 ----------------
+
+class PriceHistory:
+    """
+    每个 (symbol, exchange) 一个固定容量的环形缓冲区，时间戳和价格存放在连续的 double 数组中（不是 Python 对象）。
+    指定 path 时使用内存映射文件，重启后历史仍在；占用空间固定为 max_pairs × capacity × 16 字节。
+    文件布局: 头部(64B) | 键名区(max_pairs × 64B) | 元数据(max_pairs × [写入位置, 条数] int64) | 数据(max_pairs × [capacity 个时间戳, capacity 个价格] double)
+    """
+
+    MAGIC = b'BNPHIST1'
+    HEADER = struct.Struct('<8sqq')
+    HEADER_SIZE = 64
+    KEY_SIZE = 64
+
+    def __init__(self, capacity=28800, max_pairs=64, path=None):
+        self.path = path
+        self._mmap = None
+        self._file = None
+        if path:
+            buf, capacity, max_pairs = self._open_file(path, capacity, max_pairs)
+        else:
+            buf = bytearray(self.file_size(capacity, max_pairs))
+            self.HEADER.pack_into(buf, 0, self.MAGIC, capacity, max_pairs)
+        self.capacity = capacity
+        self.max_pairs = max_pairs
+        keys_end = self.HEADER_SIZE + max_pairs * self.KEY_SIZE
+        meta_end = keys_end + max_pairs * 16
+        self._view = memoryview(buf)
+        self._keys = self._view[self.HEADER_SIZE:keys_end]
+        self._meta = self._view[keys_end:meta_end].cast('q')
+        self._data = self._view[meta_end:].cast('d')
+        self._slots = {}  # dict: (symbol, exchange) -> 槽位
+        for slot in range(max_pairs):
+            raw = bytes(self._keys[slot * self.KEY_SIZE:(slot + 1) * self.KEY_SIZE]).rstrip(b'\0')
+            if raw:
+                symbol, exchange = raw.decode('utf-8').split('|', 1)
+                self._slots[(symbol, exchange)] = slot
+
+    @classmethod
+    def file_size(cls, capacity, max_pairs):
+        return cls.HEADER_SIZE + max_pairs * (cls.KEY_SIZE + 16 + capacity * 16)
+
+    def _open_file(self, path, capacity, max_pairs):
+        """打开已有历史文件；容量不一致或文件损坏时重建"""
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                header = f.read(self.HEADER.size)
+            if len(header) == self.HEADER.size:
+                magic, stored_capacity, stored_pairs = self.HEADER.unpack(header)
+                if (magic == self.MAGIC and stored_capacity == capacity and stored_pairs >= max_pairs
+                        and os.path.getsize(path) == self.file_size(stored_capacity, stored_pairs)):
+                    self._file = open(path, 'r+b')
+                    self._mmap = mmap.mmap(self._file.fileno(), 0)
+                    return self._mmap, stored_capacity, stored_pairs
+            print(f"⚠️ 历史文件 {path} 与当前容量配置不一致，重新创建。")
+        self._file = open(path, 'w+b')
+        self._file.truncate(self.file_size(capacity, max_pairs))
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self.HEADER.pack_into(self._mmap, 0, self.MAGIC, capacity, max_pairs)
+        return self._mmap, capacity, max_pairs
+
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is None and len(self._slots) < self.max_pairs:
+            slot = len(self._slots)
+            raw = f"{key[0]}|{key[1]}".encode('utf-8')[:self.KEY_SIZE]
+            self._keys[slot * self.KEY_SIZE:slot * self.KEY_SIZE + len(raw)] = raw
+            self._slots[key] = slot
+        return slot
+
+    def append(self, key, ts, price):
+        """追加一条记录，缓冲区满时覆盖最旧的；槽位用完返回 False"""
+        slot = self._slot(key)
+        if slot is None:
+            return False
+        meta, capacity = self._meta, self.capacity
+        pos, count = meta[2 * slot], meta[2 * slot + 1]
+        base = slot * capacity * 2
+        self._data[base + pos] = ts
+        self._data[base + capacity + pos] = price
+        meta[2 * slot] = (pos + 1) % capacity
+        meta[2 * slot + 1] = min(count + 1, capacity)
+        return True
+
+    def __len__(self):
+        return len(self._slots)
+
+    def count(self, key):
+        slot = self._slots.get(key)
+        return 0 if slot is None else self._meta[2 * slot + 1]
+
+    def _index(self, slot, i):
+        """逻辑序号 i（0 为最旧）-> 数据数组中时间戳的位置"""
+        pos, count = self._meta[2 * slot], self._meta[2 * slot + 1]
+        return slot * self.capacity * 2 + (pos - count + i) % self.capacity
+
+    def latest(self, key):
+        """最近一条 (时间戳, 价格)，没有记录返回 None"""
+        slot = self._slots.get(key)
+        if slot is None or not self._meta[2 * slot + 1]:
+            return None
+        idx = self._index(slot, self._meta[2 * slot + 1] - 1)
+        return self._data[idx], self._data[idx + self.capacity]
+
+    def price_at(self, key, ts):
+        """
+        ts 时刻的价格：时间戳 <= ts 的最后一条记录（二分查找）。
+        记录都晚于 ts 时返回最旧一条；没有记录返回 None。
+        :return: (时间戳, 价格) 或 None
+        """
+        slot = self._slots.get(key)
+        count = 0 if slot is None else self._meta[2 * slot + 1]
+        if not count:
+            return None
+        data = self._data
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[self._index(slot, mid)] <= ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        idx = self._index(slot, max(lo - 1, 0))
+        return data[idx], data[idx + self.capacity]
+
+    def window(self, key, seconds, now=None):
+        """最近 seconds 秒内的记录 [(时间戳, 价格), ...]，从旧到新"""
+        slot = self._slots.get(key)
+        count = 0 if slot is None else self._meta[2 * slot + 1]
+        since = (time.time() if now is None else now) - seconds
+        out = []
+        for i in range(count - 1, -1, -1):
+            idx = self._index(slot, i)
+            if self._data[idx] < since:
+                break
+            out.append((self._data[idx], self._data[idx + self.capacity]))
+        out.reverse()
+        return out
+
+    def change_pct(self, key, current_price, seconds, now=None):
+        """当前价格相对 seconds 秒前价格的变化百分比，没有历史返回 None"""
+        ref = self.price_at(key, (time.time() if now is None else now) - seconds)
+        if ref is None or ref[1] <= 0:
+            return None
+        return (current_price - ref[1]) / ref[1] * 100
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        """释放视图并关闭内存映射文件"""
+        self.flush()
+        for view in (self._data, self._meta, self._keys, self._view):
+            view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+def calc_change_pct(key, current_price):
+    """变化百分比：配置了 change_window 时为窗口内变化，否则为相对上一次价格"""
+    if change_window > 0 and price_history is not None:
+        pct = price_history.change_pct(key, current_price, change_window)
+        if pct is not None:
+            return pct
+    last_price = last_prices.get(key, None)
+    return ((current_price - last_price) / last_price * 100) if last_price else 0
+
+def record_price(key, price):
+    """记录最新价格（last_prices 和价格历史）"""
+    last_prices[key] = price
+    metrics.mark_price(key)
+    if price_history is not None and price > 0:
+        price_history.append(key, time.time(), price)
+
+def report_first_price():
+    """第一个价格到达时打印启动耗时（time-to-first-price）"""
+    global first_price_time
+    first_price_time = time.perf_counter() - _launch_time
+    print_colored(f"首个价格到达: 启动后 {first_price_time * 1000:.0f}ms", 'green')
+
+# ---------------- 共享内存价格表 ----------------
+
+class SharedPriceTable:
+    """
+    多进程分片模式下的价格表：每个 (symbol, exchange) 一个固定槽位，放在 multiprocessing.shared_memory 中。
+    工作进程写入自己负责的槽位，协调进程直接读取，数据不经过管道复制。
+    每个槽位只有一个写入者，用序号做顺序锁（写入前后各加 1，读到奇数或前后不一致则重读）。
+    布局: 头部(64B: 魔数, 槽位数) | 槽位(slots × 128B: 序号 int64, 价格 double, 更新时间 double, 错误长度 int32, 错误消息 96B)
+    """
+
+    MAGIC = b'BNPRICE1'
+    HEADER = struct.Struct('<8sq')
+    HEADER_SIZE = 64
+    SLOT_SIZE = 128
+    SEQ = struct.Struct('<q')
+    BODY = struct.Struct('<ddi4x96s')
+    ERROR_SIZE = 96
+    READ_RETRIES = 1000
+
+    def __init__(self, slots=0, name=None):
+        from multiprocessing import shared_memory
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + slots * self.SLOT_SIZE)
+            self.HEADER.pack_into(self.shm.buf, 0, self.MAGIC, slots)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+            _untrack_shared_memory(self.shm)
+            magic, slots = self.HEADER.unpack_from(self.shm.buf, 0)
+            if magic != self.MAGIC:
+                raise ValueError(f"共享内存 {name} 不是价格表")
+        self.name = self.shm.name
+        self.slots = slots
+        self._buf = self.shm.buf
+
+    def write(self, slot, price, error=None):
+        """写入一个槽位（仅该槽位的负责进程调用）"""
+        offset = self.HEADER_SIZE + slot * self.SLOT_SIZE
+        buf = self._buf
+        seq = (self.SEQ.unpack_from(buf, offset)[0] + 1) & ~1  # 上个写入进程中途退出时序号为奇数，先取整到偶数
+        self.SEQ.pack_into(buf, offset, seq + 1)
+        raw = error.encode('utf-8')[:self.ERROR_SIZE] if error else b''
+        self.BODY.pack_into(buf, offset + 8, math.nan if price is None else price, time.time(), len(raw), raw)
+        self.SEQ.pack_into(buf, offset, seq + 2)
+
+    def read(self, slot):
+        """
+        读取一个槽位的一致快照。
+        :return: (序号, 价格, 更新时间, 错误消息)，从未写入时序号为 0
+        """
+        offset = self.HEADER_SIZE + slot * self.SLOT_SIZE
+        buf = self._buf
+        for _ in range(self.READ_RETRIES):
+            seq = self.SEQ.unpack_from(buf, offset)[0]
+            if seq & 1:
+                continue  # 正在写入
+            price, updated, error_len, raw = self.BODY.unpack_from(buf, offset + 8)
+            if self.SEQ.unpack_from(buf, offset)[0] == seq:
+                error = raw[:error_len].decode('utf-8', errors='ignore') if error_len else None
+                return seq, price, updated, error
+        return seq, math.nan, 0.0, STALE_ERROR  # 写入进程中途退出，槽位一直处于写入状态
+
+    def close(self):
+        """释放映射；创建者同时删除共享内存"""
+        self._buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _untrack_shared_memory(shm):
+    """附加到已有共享内存的进程不应在退出时删除它（Python 3.13 之前会被 resource_tracker 登记）"""
+    if os.name != 'posix' or multiprocessing.parent_process() is not None:
+        return  # multiprocessing 子进程与父进程共用 resource_tracker，注销会抹掉创建者的登记
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+# ---------------- 警报声音 ----------------
+
+_sounds = {}  # dict: 音频文件路径 -> pygame.mixer.Sound（每个文件只解码一次）
+_sounds_lock = threading.Lock()
+
+def load_sound(path):
+    """导入 pygame、初始化混音器并解码音频文件，结果缓存"""
+    sound = _sounds.get(path)
+    if sound is None:
+        with _sounds_lock:
+            sound = _sounds.get(path)
+            if sound is None:
+                os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+                import pygame
+                if not pygame.mixer.get_init():
+                    pygame.mixer.init()
+                sound = _sounds[path] = pygame.mixer.Sound(path)
+    return sound
+
+class AlertSound:
+    """
+    懒加载的警报声音（使用Sound以支持不同币种叠加，但同币种不叠加）：
+    第一次报警时才导入 pygame 并解码音频，启动和第一轮请求不受影响。
+    加载失败时只提示一次，之后静音。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.failed = False
+
+    def play(self):
+        """播放并返回 Channel，静音时返回 None"""
+        if self.failed:
+            return None
+        try:
+            return load_sound(self.path).play()
+        except Exception as e:
+            self.failed = True
+            print_colored(f"⚠️ 警报声音加载失败: {e}，警报将静音。", 'yellow')
+            return None
+
+# ---------------- 报警分发 ----------------
+# 报警的副作用（控制台提示、声音、webhook、文件）不在抓取主循环中执行：主循环只把报警放入有界队列，
+# 由分发线程依次交给各输出端（sink）。输出端再慢也只拖慢分发线程，不影响价格采集。
+
+@dataclass
+class AlertEvent:
+    symbol: str
+    kind: str  # 'level' 档位穿越 / 'change' 波动 / 'gap' 比价
+    exchange: str  # 比价报警为 ''
+    lines: list  # [(文本, 颜色), ...] 控制台输出
+    fields: dict  # 结构化字段（webhook / 文件输出）
+    timestamp: float = field(default_factory=time.time)
+    created: float = field(default_factory=time.monotonic)  # 入队时间（合并后保留最早一条的），用于统计分发耗时
+    count: int = 1  # 合并的报警条数
+
+    def to_dict(self):
+        return {'symbol': self.symbol, 'type': self.kind, 'exchange': self.exchange, 'time': self.timestamp,
+                'count': self.count, 'message': ' '.join(text.strip() for text, _ in self.lines), **self.fields}
+
+class ConsoleSink:
+    """控制台（仪表盘模式下进入消息区）"""
+    name = 'console'
+
+    def deliver(self, event):
+        for i, (text, color) in enumerate(event.lines):
+            if i == 0 and event.count > 1:
+                text += f"（合并 {event.count} 条）"
+            print_colored(text, color)
+
+class SoundSink:
+    """声音报警：不同币种可叠加，同币种不叠加"""
+    name = 'sound'
+
+    def __init__(self, alert_sound):
+        self.alert_sound = alert_sound
+        self.channels = {}  # dict: symbol -> Channel
+
+    def deliver(self, event):
+        channel = self.channels.get(event.symbol)
+        if channel is None or not channel.get_busy():
+            self.channels[event.symbol] = self.alert_sound.play()
+
+class WebhookSink:
+    """POST JSON 到 webhook 地址"""
+    name = 'webhook'
+
+    def __init__(self, url, timeout=2.0):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def deliver(self, event):
+        response = self.session.post(self.url, json=event.to_dict(), timeout=self.timeout)
+        response.raise_for_status()
+
+class FileSink:
+    """每条报警追加一行 JSON"""
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def deliver(self, event):
+        self.file.write(json.dumps(event.to_dict(), ensure_ascii=False) + '\n')
+        self.file.flush()
+
+class AlertDispatcher:
+    """
+    有界报警队列 + 分发线程。
+    submit() 只做一次加锁入队，从不等待输出端；同一 (币种, 类型) 在队列中只占一个位置，
+    分发线程忙或处于合并窗口内时，后来的同类报警合并进去（保留最新内容并计数）。
+    队列满时丢弃新的报警并计入指标。
+    """
+
+    def __init__(self, sinks, maxsize=1000, coalesce_window=0.0):
+        self.sinks = list(sinks)
+        self.maxsize = maxsize
+        self.coalesce_window = coalesce_window
+        self._pending = {}  # dict: (symbol, kind) -> AlertEvent，按首次入队顺序
+        self._cond = threading.Condition()
+        self._closed = False
+        self._failing = set()  # 正在失败的 sink（只提示一次，恢复后再提示）
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def depth(self):
+        return len(self._pending)
+
+    def submit(self, event):
+        """报警入队，返回是否被接收（入队或合并）"""
+        key = (event.symbol, event.kind)
+        with self._cond:
+            previous = self._pending.get(key)
+            if previous is not None:
+                event.count += previous.count
+                event.created = previous.created
+                self._pending[key] = event
+                metrics.count_alert('coalesced')
+                return True
+            if len(self._pending) >= self.maxsize:
+                metrics.count_alert('dropped')
+                return False
+            self._pending[key] = event
+            self._cond.notify()
+        metrics.count_alert('queued')
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+            if self.coalesce_window and not self._closed:
+                time.sleep(self.coalesce_window)  # 收集同一波报警，合并后再输出
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            for event in batch.values():
+                self._deliver(event)
+
+    def _deliver(self, event):
+        for sink in self.sinks:
+            try:
+                sink.deliver(event)
+            except Exception as e:
+                metrics.count_sink_error(sink.name)
+                if sink.name not in self._failing:
+                    self._failing.add(sink.name)
+                    print_colored(f"⚠️ 报警输出 {sink.name} 失败: {e}", 'yellow')
+            else:
+                if sink.name in self._failing:
+                    self._failing.discard(sink.name)
+                    print_colored(f"✅ 报警输出 {sink.name} 已恢复", 'green')
+        metrics.observe_dispatch(time.monotonic() - event.created)
+        metrics.count_alert('delivered')
+
+    def close(self, timeout=1.0):
+        """停止接收并等待队列中剩余报警分发完成（最多 timeout 秒）"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+def build_alert_sinks(config, alert_sound=None):
+    """按 alert_sinks 配置创建输出端；声音文件不存在时跳过 sound"""
+    sinks = []
+    for name in config.get('alert_sinks') or ['console', 'sound']:
+        if name == 'console':
+            sinks.append(ConsoleSink())
+        elif name == 'sound':
+            if alert_sound is not None:
+                sinks.append(SoundSink(alert_sound))
+        elif name == 'webhook':
+            url = config.get('alert_webhook_url')
+            if not url:
+                print("⚠️ 警告: 未配置 alert_webhook_url，跳过 webhook 报警输出。")
+                continue
+            sinks.append(WebhookSink(url, config.get('alert_webhook_timeout', 2.0)))
+        elif name == 'file':
+            sinks.append(FileSink(config.get('alert_file') or 'alerts.jsonl'))
+        else:
+            print(f"⚠️ 警告: 未知报警输出 {name}（可选: console / sound / webhook / file），已忽略。")
+    return sinks
+
+def start_alert_dispatcher(config, alert_sound=None):
+    global alert_dispatcher
+    sinks = build_alert_sinks(config, alert_sound)
+    alert_dispatcher = AlertDispatcher(sinks, config.get('alert_queue_size', 1000),
+                                       config.get('alert_coalesce_window', 0.5)).start()
+    return alert_dispatcher
+
+def dispatch_alert(event):
+    """报警入队；未启动分发线程时（如基准测试）直接输出到控制台"""
+    if alert_dispatcher is None:
+        ConsoleSink().deliver(event)
+    else:
+        alert_dispatcher.submit(event)
+
+# ---------------- 报警规则 ----------------
+
+@dataclass
+class AlertRule:
+    level: float
+    direction: str  # 'up' 向上突破（价格 > level）/ 'down' 向下跌破（价格 < level）
+    hysteresis: float = 0.0  # 回差（百分比）：触发后价格需回到 level 另一侧 hysteresis% 之外才重新布防
+    cooldown: float = 0.0  # 冷却（秒）：两次提示的最小间隔，冷却内的穿越不提示，冷却结束时价格仍在报警区则补发一次（去抖）
+    name: str = ''
+    last_fired: float = -math.inf
+
+    def rearm_price(self):
+        """重新布防的价格：向上规则需回落到该价格以下，向下规则需回升到该价格以上"""
+        if self.direction == 'up':
+            return self.level * (1 - self.hysteresis / 100)
+        return self.level * (1 + self.hysteresis / 100)
+
+class _RuleIndex:
+    """单个 (symbol, exchange) 的规则索引：按价格排序的已布防/待重新布防列表，元素为 (价格, 规则编号)"""
+
+    def __init__(self):
+        self.armed_up = []
+        self.armed_down = []
+        self.rearm_up = []
+        self.rearm_down = []
+        self.levels_up = []  # 全部向上规则价格（判断价格是否处于报警区）
+        self.levels_down = []
+        self.cooling = []  # 冷却中被挡下的穿越（规则编号）：冷却结束时价格仍在报警区则补发，否则重新布防
+
+class AlertEngine:
+    """
+    报警规则引擎：每个 (symbol, exchange) 可有任意多个价格档位。
+    规则按价格保存在有序索引中，每次价格更新只二分查找 上次价格 → 当前价格 之间被穿越的档位，
+    复杂度 O(log n + 触发数)，不会每轮重新扫描全部规则。
+    触发后规则撤防，价格回到回差带之外才重新布防，因此价格停留在报警区时不会每轮重复报警。
+    """
+
+    def __init__(self):
+        self.rules = []  # 规则编号 -> AlertRule
+        self.indexes = {}  # dict: (symbol, exchange) -> _RuleIndex
+
+    def add_rule(self, key, rule):
+        if rule.direction not in ('up', 'down'):
+            raise ValueError(f"报警方向必须为 up 或 down: {rule.direction}")
+        index = self.indexes.setdefault(key, _RuleIndex())
+        rule_id = len(self.rules)
+        self.rules.append(rule)
+        if rule.direction == 'up':
+            bisect.insort(index.armed_up, (rule.level, rule_id))
+            bisect.insort(index.levels_up, rule.level)
+        else:
+            bisect.insort(index.armed_down, (rule.level, rule_id))
+            bisect.insort(index.levels_down, rule.level)
+        return rule_id
+
+    def rule_count(self, key):
+        index = self.indexes.get(key)
+        return 0 if index is None else len(index.levels_up) + len(index.levels_down)
+
+    def is_beyond(self, key, price):
+        """价格是否处于任一档位的报警区（高于最低的向上档位或低于最高的向下档位）"""
+        index = self.indexes.get(key)
+        if index is None:
+            return False
+        return bool((index.levels_up and price > index.levels_up[0]) or
+                    (index.levels_down and price < index.levels_down[-1]))
+
+    def evaluate(self, key, prev, curr, now=None):
+        """
+        价格从 prev 变为 curr 时检查被穿越的档位。prev 为 None（首个价格）时，已处于报警区的规则触发一次。
+        :return: 本次需要提示的规则列表
+        """
+        index = self.indexes.get(key)
+        if index is None or curr is None or curr <= 0:
+            return []
+        now = time.time() if now is None else now
+        inf = math.inf
+
+        fired = []
+        # 冷却中被挡下的规则：冷却结束后价格仍在报警区则补发一次，已回到另一侧则重新布防
+        if index.cooling:
+            still_cooling = []
+            for rule_id in index.cooling:
+                rule = self.rules[rule_id]
+                if now - rule.last_fired < rule.cooldown:
+                    still_cooling.append(rule_id)
+                elif (curr > rule.level) if rule.direction == 'up' else (curr < rule.level):
+                    fired.append(rule)
+                    rule.last_fired = now
+                    rearm = index.rearm_up if rule.direction == 'up' else index.rearm_down
+                    bisect.insort(rearm, (rule.rearm_price(), rule_id))
+                else:
+                    armed = index.armed_up if rule.direction == 'up' else index.armed_down
+                    bisect.insort(armed, (rule.level, rule_id))
+            index.cooling = still_cooling
+
+        # 向上突破: prev <= level < curr；向下跌破: curr < level <= prev
+        up_lo = 0 if prev is None else bisect.bisect_left(index.armed_up, (prev,))
+        up_hi = bisect.bisect_left(index.armed_up, (curr,))
+        down_lo = bisect.bisect_right(index.armed_down, (curr, inf))
+        down_hi = len(index.armed_down) if prev is None else bisect.bisect_right(index.armed_down, (prev, inf))
+
+        crossed = []
+        if up_lo < up_hi:
+            crossed += index.armed_up[up_lo:up_hi]
+            del index.armed_up[up_lo:up_hi]
+        if down_lo < down_hi:
+            crossed += index.armed_down[down_lo:down_hi]
+            del index.armed_down[down_lo:down_hi]
+        for _, rule_id in crossed:
+            rule = self.rules[rule_id]
+            if now - rule.last_fired < rule.cooldown:
+                index.cooling.append(rule_id)
+                continue
+            fired.append(rule)
+            rule.last_fired = now
+            rearm = index.rearm_up if rule.direction == 'up' else index.rearm_down
+            bisect.insort(rearm, (rule.rearm_price(), rule_id))
+
+        # 重新布防：向上规则价格回落到回差带以下，向下规则价格回升到回差带以上
+        cut = bisect.bisect_left(index.rearm_up, (curr,))
+        for entry in index.rearm_up[cut:]:
+            bisect.insort(index.armed_up, (self.rules[entry[1]].level, entry[1]))
+        del index.rearm_up[cut:]
+        cut = bisect.bisect_right(index.rearm_down, (curr, inf))
+        for entry in index.rearm_down[:cut]:
+            bisect.insort(index.armed_down, (self.rules[entry[1]].level, entry[1]))
+        del index.rearm_down[:cut]
+        return fired
+
+def load_alert_rules(sc, default_hysteresis=0.0, default_cooldown=0.0):
+    """
+    读取币种的报警规则：alerts 列表中的多档位规则，以及旧的 alert_price（向上）/ low_alert_price（向下）。
+    :return: [AlertRule, ...]
+    """
+    rules = []
+    if sc.get('alert_price', 0) > 0:
+        rules.append(AlertRule(sc['alert_price'], 'up', default_hysteresis, default_cooldown, '高价警报'))
+    if sc.get('low_alert_price', 0) > 0:
+        rules.append(AlertRule(sc['low_alert_price'], 'down', default_hysteresis, default_cooldown, '低价警报'))
+    for item in sc.get('alerts') or []:
+        direction = item.get('direction', 'up')
+        rules.append(AlertRule(float(item['price']), direction,
+                               float(item.get('hysteresis', default_hysteresis)),
+                               float(item.get('cooldown', default_cooldown)),
+                               item.get('name') or ('高价警报' if direction == 'up' else '低价警报')))
+    return rules
+
 def format_symbol(symbol):
     """格式化符号为 BASE/QUOTE"""
-    if len(symbol) > 3:
-        base = symbol[:-4]
-        quote = symbol[-4:]
-        return f"{base}/{quote}"
-    return symbol
+    base, quote = split_symbol(symbol)
+    return f"{base}/{quote}" if quote else symbol
 
-def load_config():
+def load_config(config_file='config.yaml'):
     """加载YAML配置文件，回退到默认"""
-    config_file = 'config.yaml'
     default_single = {
         'symbol': 'BTCUSDT',
         'alert_price': 97500.0,
@@ -202,9 +2161,54 @@ def load_config():
     }
     default_config = {
         'symbols': [default_single],
+        'mode': '',  # single 单个交易所价格警报 / multi 多个交易所比价；留空按 exchanges 数量推断
+        'exchanges': [],  # 监控的交易所；留空则启动时交互选择
         'interval': 1,
         'music_file': 'music.mp3',
-        'price_gap_threshold': 1.0  # 默认价格差距阈值 1%
+        'price_gap_threshold': 1.0,  # 默认价格差距阈值 1%
+        'max_workers': 16,  # 并发请求线程数
+        'tick_deadline': 3.0,  # 每轮抓取截止时间（秒），超时结果标记为过期
+        'batch_mode': True,  # 批量行情模式：每个交易所每轮一次请求
+        'batch_min_symbols': 2,  # 少于该币种数时走逐个请求
+        'batch_exclude': [],  # 始终走逐个请求的交易所
+        'http_pool_size': 16,  # 每个交易所的 keep-alive 连接池大小
+        'connect_timeout': 3.0,  # 连接超时（秒）
+        'read_timeout': 5.0,  # 读取超时（秒）
+        'exchange_timeouts': {},  # 各交易所单独超时: exchange -> [connect, read]
+        'adaptive_timeout': True,  # 按各交易所近期 p99 耗时收紧读取超时
+        'timeout_p99_multiplier': 3.0,  # 自适应读取超时 = p99 × 该倍数
+        'min_read_timeout': 1.0,  # 自适应读取超时下限（秒）
+        'breaker_failures': 5,  # 连续失败多少次熔断，0 关闭
+        'breaker_cooldown': 5.0,  # 首次熔断时长（秒），探测失败后翻倍
+        'breaker_max_cooldown': 300.0,  # 熔断时长上限（秒）
+        'hedge_delay': 'auto',  # 关键币种对冲请求延迟（秒），'auto' 为近期 p90 耗时
+        'conn_stats_interval': 60,  # 连接复用统计打印间隔（秒），0 关闭
+        'metrics_port': 0,  # Prometheus 指标端点端口，0 关闭
+        'metrics_summary_interval': 60,  # 指标汇总行打印间隔（秒），0 关闭
+        'stream_mode': False,  # WebSocket 推送模式
+        'stream_urls': {},  # 覆盖推送地址: exchange -> ws://...
+        'stream_max_price_age': 30,  # 推送模式比价只使用该秒数内收到的价格，0 不限制
+        'exchange_intervals': {},  # 各交易所轮询周期: exchange -> 秒 或 'auto'
+        'rate_limits': {},  # 各交易所限频覆盖: exchange -> 请求/秒
+        'display_mode': 'log',  # 显示模式: log 滚动日志 / dashboard 原地刷新仪表盘
+        'render_fps': 5,  # 仪表盘最大刷新帧率
+        'history_capacity': 28800,  # 每个交易对保留的历史条数
+        'history_file': '',  # 历史持久化文件（内存映射），空为仅内存
+        'change_window': 0,  # 变化率窗口（秒），0 表示相对上一次价格
+        'alert_hysteresis': 0.0,  # 报警回差（百分比），价格回到回差带之外才会再次报警
+        'alert_cooldown': 0.0,  # 同一报警两次提示的最小间隔（秒）
+        'alert_sinks': ['console', 'sound'],  # 报警输出端: console / sound / webhook / file
+        'alert_webhook_url': '',
+        'alert_webhook_timeout': 2.0,
+        'alert_file': 'alerts.jsonl',
+        'alert_queue_size': 1000,  # 报警队列上限（按 币种+类型 合并后计）
+        'alert_coalesce_window': 0.5,  # 合并窗口（秒）：窗口内同一币种同类报警合并为一条
+        'symbol_discovery': True,  # 启动时加载交易对列表，剔除交易所未上架的币种
+        'symbol_cache_file': 'symbols_cache.json',
+        'symbol_cache_ttl': 86400,  # 交易对列表缓存有效期（秒）
+        'symbol_refresh_interval': 3600,  # 后台刷新交易对列表的间隔（秒），0 关闭
+        'workers': 0,  # 多进程分片：工作进程数，0 单进程，'auto' 为 CPU 核数 - 1
+        'base_urls': {}  # 覆盖交易所 REST 地址: exchange -> http://...（如本地模拟交易所）
     }
     
     if os.path.exists(config_file):
@@ -221,7 +2225,7 @@ def load_config():
                     if key not in config:
                         config[key] = value
                 for sym_config in config['symbols']:
-                    for k, v in {'alert_price': 97500.0, 'low_alert_price': 0}.items():
+                    for k, v in {'alert_price': 97500.0, 'low_alert_price': 0, 'change_alert_pct': 0, 'critical': False}.items():
                         sym_config.setdefault(k, v)
                 config.setdefault('price_gap_threshold', 1.0)
                 return config
@@ -233,7 +2237,7 @@ def load_config():
 
 def select_mode_and_exchanges():
     """选择模式并选择交易所"""
-    exchanges_list = ['币安', 'okx', '芝麻开门', 'bitget', '库币', '抹茶', '火币', 'bybit']
+    exchanges_list = list(EXCHANGE_ADAPTERS)
     print("\n请选择模式:")
     print("1. 交易所价格警报模式")
     print("2. 多个交易所比价模式")
@@ -246,8 +2250,8 @@ def select_mode_and_exchanges():
                     print(f"{i}. {ex.upper()}")
                 while True:
                     try:
-                        choice = int(input("请输入序号 (1-8): "))
-                        if 1 <= choice <= 8:
+                        choice = int(input(f"请输入序号 (1-{len(exchanges_list)}): "))
+                        if 1 <= choice <= len(exchanges_list):
                             return [exchanges_list[choice - 1]]
                         else:
                             print("无效序号，请重新输入。")
@@ -266,7 +2270,7 @@ def select_mode_and_exchanges():
                     if not indices:
                         print("无效输入，请重新输入。")
                         continue
-                    valid_indices = [idx for idx in indices if 1 <= idx <= 8]
+                    valid_indices = [idx for idx in indices if 1 <= idx <= len(exchanges_list)]
                     if len(valid_indices) != len(indices):
                         print("有些序号无效，请重新输入。")
                         continue
@@ -280,12 +2284,765 @@ def select_mode_and_exchanges():
         except ValueError:
             print("请输入有效数字。")
 
-def main():
+def resolve_exchanges(config, mode=None, exchanges=None, daemon=False):
+    """
+    确定监控的交易所：命令行优先，其次配置中的 mode/exchanges，都没有时进入交互菜单。
+    守护模式不交互，未指定交易所时报错。
+    :param exchanges: 交易所列表或逗号分隔的字符串
+    :return: 交易所列表
+    """
+    mode = mode or config.get('mode') or None
+    if isinstance(exchanges, str):
+        exchanges = [e.strip() for e in exchanges.split(',') if e.strip()]
+    exchanges = exchanges or config.get('exchanges') or []
+    if not exchanges:
+        if daemon:
+            raise ValueError("守护模式需要通过 --exchanges 或配置 exchanges 指定交易所")
+        return select_mode_and_exchanges()
+
+    names = {name.lower(): name for name in EXCHANGE_ADAPTERS}
+    selected = []
+    for exchange in exchanges:
+        name = names.get(str(exchange).lower())
+        if name is None:
+            raise ValueError(f"未知交易所: {exchange}（可选: {', '.join(EXCHANGE_ADAPTERS)}）")
+        if name not in selected:
+            selected.append(name)
+    if mode not in (None, 'single', 'multi'):
+        raise ValueError(f"未知模式: {mode}（可选: single / multi）")
+    if mode == 'single' and len(selected) != 1:
+        raise ValueError("single 模式只能指定 1 个交易所")
+    if mode == 'multi' and len(selected) < 2:
+        raise ValueError("multi 模式需至少指定 2 个交易所")
+    return selected
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="交易所价格监控与比价报警")
+    parser.add_argument('--config', default='config.yaml', help="配置文件路径（默认 config.yaml）")
+    parser.add_argument('--mode', choices=['single', 'multi'],
+                        help="single 单个交易所价格警报 / multi 多个交易所比价（默认按交易所数量推断）")
+    parser.add_argument('--exchanges', help=f"交易所，逗号分隔，可选: {','.join(EXCHANGE_ADAPTERS)}")
+    parser.add_argument('--daemon', action='store_true',
+                        help="守护模式：不交互，模式和交易所取自命令行或配置，适合在进程管理器下运行")
+    return parser.parse_args(argv)
+
+def process_single_exchange(timestamp, sc, exchange, results):
+    """单个交易所模式：打印价格并检查价格档位报警（只在穿越档位时提示）"""
+    symbol = sc['symbol']
+    formatted_symbol = format_symbol(symbol)
+    key = (symbol, exchange)
+    if key not in results:
+        return  # 本轮未轮询该交易所
+    current_price, error = results[key]
+
+    if error:
+        print_aligned(timestamp, exchange, formatted_symbol, error, 0, is_error=True)
+        return
+
+    change_pct = calc_change_pct(key, current_price)
+
+    # 检查是否穿越报警档位
+    fired = []
+    is_alert = False
+    if alert_engine is not None:
+        fired = alert_engine.evaluate(key, last_prices.get(key), current_price)
+        is_alert = bool(fired) or alert_engine.is_beyond(key, current_price)
+    print_aligned(timestamp, exchange, formatted_symbol, current_price, change_pct, is_alert=is_alert)
+
+    if fired:
+        lines = [(f"⚠️ {rule.name}！[{exchange.upper()}] {formatted_symbol} 价格 {current_price:.4f} "
+                  f"{'>' if rule.direction == 'up' else '<'} {rule.level}！", 'red') for rule in fired]
+        rules = [{'name': rule.name, 'level': rule.level, 'direction': rule.direction} for rule in fired]
+        dispatch_alert(AlertEvent(symbol, 'level', exchange, lines, {'price': current_price, 'rules': rules}))
+
+    check_change_alert(sc, exchange, change_pct)
+    record_price(key, current_price)
+
+def check_change_alert(sc, exchange, change_pct):
+    """波动报警：变化幅度（change_window 秒内或相对上次）超过 change_alert_pct"""
+    threshold = sc.get('change_alert_pct', 0)
+    if threshold <= 0 or abs(change_pct) < threshold:
+        return False
+    symbol = sc['symbol']
+    window_text = f"{change_window}s 内" if change_window > 0 else "较上次"
+    text = f"⚠️ 波动警报！[{exchange.upper()}] {format_symbol(symbol)} {window_text}变化 {change_pct:+.2f}% (阈值 ±{threshold}%)"
+    dispatch_alert(AlertEvent(symbol, 'change', exchange, [(text, 'red')],
+                              {'change_pct': change_pct, 'threshold': threshold, 'window': change_window}))
+    return True
+
+def process_multi_exchange(timestamp, sc, exchanges, results, price_gap_threshold, spread=None, matrix=None):
+    """
+    多个交易所模式：打印本轮轮询到的各交易所价格并检查比价报警。
+    各交易所轮询周期不同时，本轮未轮询的交易所沿用其最近一次有效价格参与比价。
+    :param spread: SpreadMatrix.compute() 中该币种的结果 (差距%, 买入交易所, 卖出交易所, 有效价格数, 是否报警)，
+                   None 时按本币种单独计算
+    :param matrix: 计算 spread 的 SpreadMatrix（报警时取出各交易所价格）
+    """
+    symbol = sc['symbol']
+    formatted_symbol = format_symbol(symbol)
+    prices = {}
+    changes = {}  # dict: exchange -> 变化百分比
+    errors = {}
+    invalid_prices = {}  # 记录无效价格
+    held_prices = {}  # 本轮未轮询、沿用上次价格的交易所
+    for exchange in exchanges:
+        if (symbol, exchange) not in results:
+            last_price = last_prices.get((symbol, exchange))
+            if last_price and last_price > 0:
+                held_prices[exchange] = last_price
+            continue
+        key = (symbol, exchange)
+        current_price, error = results[key]
+        if error:
+            errors[exchange] = error
+        elif current_price > 0:  # 有效价格
+            prices[exchange] = current_price
+            changes[exchange] = calc_change_pct(key, current_price)
+        else:  # 价格 <=0，无效
+            invalid_prices[exchange] = current_price
+            change_pct = calc_change_pct(key, current_price)
+            print_aligned(timestamp, exchange, formatted_symbol, current_price, change_pct, is_invalid=True)
+        if not error:  # 无论有效无效，都更新 last_price
+            record_price(key, current_price)
+
+    # 处理错误（使用对齐）
+    for exchange, error in errors.items():
+        print_aligned(timestamp, exchange, formatted_symbol, error, 0, is_error=True)
+
+    # 打印有效价格（使用对齐函数）
+    for exchange, price in prices.items():
+        print_aligned(timestamp, exchange, formatted_symbol, price, changes[exchange])
+        check_change_alert(sc, exchange, changes[exchange])
+
+    if not prices and not errors and not invalid_prices:
+        return  # 本轮没有轮询该币种的任何交易所
+    threshold = sc.get('price_gap_threshold', price_gap_threshold)
+    gap_prices = matrix.row_prices(symbol) if matrix is not None else {**held_prices, **prices}
+    if spread is None:
+        gap_pct, buy_ex, sell_ex = best_spread(gap_prices) if len(gap_prices) >= 2 else (None, None, None)
+        valid = len(gap_prices)
+        is_gap_alert = valid >= 2 and 0 < threshold <= gap_pct
+    else:
+        gap_pct, buy_ex, sell_ex, valid, is_gap_alert = spread
+
+    # 如果有效价格 >=2，计算差距
+    if valid >= 2:
+        if dashboard is not None:
+            dashboard.set_gap(formatted_symbol, gap_pct, is_gap_alert)
+        if is_gap_alert:
+            report_gap_alert(symbol, formatted_symbol, gap_prices, gap_pct, threshold, buy_ex, sell_ex)
+    else:
+        print_colored(f"⚠️ {formatted_symbol} 有效价格不足 ({valid}/ {len(exchanges)})，跳过比价报警。", 'yellow')
+
+def best_spread(prices):
+    """
+    计算各交易所有效价格（>0）之间的最大差距百分比及对应的买入/卖出交易所。
+    :param prices: dict: exchange -> 价格
+    :return: (差距%, 最低价交易所, 最高价交易所)
+    """
+    buy_ex = min(prices, key=prices.get)
+    sell_ex = max(prices, key=prices.get)
+    min_p, max_p = prices[buy_ex], prices[sell_ex]
+    return ((max_p - min_p) / min_p) * 100, buy_ex, sell_ex  # 修复：min_p 现在 >0，无除零风险
+
+@functools.lru_cache(maxsize=None)
+def load_numpy():
+    """按需导入 numpy，未安装返回 None（比价矩阵回退为逐行计算）"""
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+class SpreadMatrix:
+    """
+    比价矩阵：币种 × 交易所 的最新价格，缺失/无效价格为 NaN。
+    一次向量化计算所有交易所两两之间的价差，得到每个币种的最佳买入/卖出交易所。
+    未轮询的交易所保留上次有效价格；出错或无效时置为 NaN。
+    未安装 numpy 时逐行计算，结果相同。
+    矩阵在第一次写入价格时才分配（numpy 在首轮抓取期间导入，不推迟第一轮请求）。
+    """
+
+    def __init__(self, symbols, exchanges, thresholds):
+        self.symbols = list(symbols)
+        self.exchanges = list(exchanges)
+        self.rows = {s: i for i, s in enumerate(self.symbols)}
+        self.cols = {e: j for j, e in enumerate(self.exchanges)}
+        self.thresholds = list(thresholds)
+        self.np = None
+        self.prices = None
+
+    def _allocate(self):
+        self.np = load_numpy()
+        if self.np is not None:
+            self.prices = self.np.full((len(self.symbols), len(self.exchanges)), self.np.nan)
+            self.thresholds = self.np.asarray(self.thresholds, dtype=float)
+        else:
+            self.prices = [[math.nan] * len(self.exchanges) for _ in self.symbols]
+
+    def set(self, symbol, exchange, price):
+        row, col = self.rows.get(symbol), self.cols.get(exchange)
+        if row is None or col is None:
+            return
+        if self.prices is None:
+            self._allocate()
+        self.prices[row][col] = price if price is not None and price > 0 else math.nan
+
+    def apply(self, results):
+        """写入本轮抓取结果: dict: (symbol, exchange) -> (价格, 错误)"""
+        for (symbol, exchange), (price, error) in results.items():
+            self.set(symbol, exchange, None if error else price)
+
+    def row_prices(self, symbol):
+        """某币种各交易所的有效价格 dict: exchange -> 价格"""
+        if self.prices is None:
+            self._allocate()
+        row = self.prices[self.rows[symbol]]
+        return {ex: float(row[j]) for ex, j in self.cols.items() if row[j] == row[j]}  # NaN != NaN
+
+    def compute(self):
+        """
+        计算所有币种的最佳价差。
+        :return: [(差距%, 买入交易所, 卖出交易所, 有效价格数, 是否报警), ...]，与 symbols 顺序一致
+        """
+        if self.prices is None:
+            self._allocate()
+        if self.np is None:
+            return self._compute_python()
+        np = self.np
+        prices = self.prices
+        n_ex = len(self.exchanges)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # gaps[s, i, j]: 在交易所 i 买入、在交易所 j 卖出的价差百分比
+            gaps = (prices[:, None, :] / prices[:, :, None] - 1) * 100
+        flat = np.where(np.isnan(gaps), -np.inf, gaps).reshape(len(self.symbols), n_ex * n_ex)
+        best = flat.argmax(axis=1)
+        gap = flat[np.arange(len(self.symbols)), best]
+        buy, sell = np.divmod(best, n_ex)
+        valid = np.count_nonzero(~np.isnan(prices), axis=1)
+        alerts = (valid >= 2) & (self.thresholds > 0) & (gap >= self.thresholds)
+        exchanges = self.exchanges
+        return [(g if v >= 2 else None, exchanges[b], exchanges[s], v, a)
+                for g, b, s, v, a in zip(gap.tolist(), buy.tolist(), sell.tolist(), valid.tolist(), alerts.tolist())]
+
+    def _compute_python(self):
+        out = []
+        for symbol, threshold in zip(self.symbols, self.thresholds):
+            prices = self.row_prices(symbol)
+            if len(prices) < 2:
+                out.append((None, None, None, len(prices), False))
+                continue
+            gap, buy_ex, sell_ex = best_spread(prices)
+            out.append((gap, buy_ex, sell_ex, len(prices), 0 < threshold <= gap))
+        return out
+
+def report_gap_alert(symbol, formatted_symbol, prices, gap_pct, price_gap_threshold, buy_ex=None, sell_ex=None):
+    """比价报警（含最佳买入/卖出交易所和各交易所价格）入队分发"""
+    lines = [(f"⚠️ 价格差距报警！{formatted_symbol} 差距 {gap_pct:.2f}% >= {price_gap_threshold}%", 'red')]
+    if buy_ex and sell_ex:
+        lines.append((f"  最低价 {buy_ex.upper()} {prices[buy_ex]:.4f} 买入 → 最高价 {sell_ex.upper()} {prices[sell_ex]:.4f} 卖出", 'yellow'))
+    # 突出打印价格（使用对齐，基于显示宽）
+    for exchange, price in prices.items():
+        ex_display = pad_display(exchange.upper(), GAP_EX_DISPLAY_WIDTH)
+        lines.append((f"  [{ex_display}] {price:>14.4f} {split_symbol(symbol)[1] or 'USDT'}", 'yellow'))
+    dispatch_alert(AlertEvent(symbol, 'gap', '', lines, {
+        'gap_pct': gap_pct, 'threshold': price_gap_threshold, 'buy': buy_ex, 'sell': sell_ex, 'prices': dict(prices)}))
+
+# ---------------- WebSocket 推送模式 ----------------
+def _decode_stream_message(raw):
+    """解码推送消息（火币为 gzip 压缩的二进制），非 JSON 消息（如 'pong'）返回 None"""
+    if isinstance(raw, bytes):
+        try:
+            raw = gzip.decompress(raw)
+        except OSError:
+            pass
+        raw = raw.decode('utf-8', errors='replace')
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+async def _app_ping(ws, message, every):
+    while True:
+        await asyncio.sleep(every)
+        await ws.send(message)
+
+async def stream_exchange(exchange, symbols, on_price, url=None):
+    """
+    订阅单个交易所的行情推送，断线后指数退避重连并重新订阅。
+    :param symbols: 配置中的符号列表
+    :param on_price: 回调 on_price(symbol, exchange, price)
+    :param url: 覆盖默认推送地址（如本地模拟服务器）
+    """
+    import websockets
+
+    spec = EXCHANGE_ADAPTERS[exchange].stream
+    natives = {exchange_symbol(exchange, s): s for s in symbols}
+    loop = asyncio.get_running_loop()
+    backoff = 1
+    while True:
+        try:
+            target = url or spec['url']
+            if callable(target):
+                target = await loop.run_in_executor(None, target)
+            async with websockets.connect(target, max_size=None, open_timeout=10) as ws:
+                for message in spec['subscribe'](list(natives)):
+                    await ws.send(message)
+                print_colored(f"✅ [{exchange.upper()}] 推送已连接，订阅 {len(natives)} 个币种", 'green')
+                backoff = 1
+                pinger = asyncio.create_task(_app_ping(ws, *spec['ping'])) if spec.get('ping') else None
+                try:
+                    async for raw in ws:
+                        data = _decode_stream_message(raw)
+                        if data is None:
+                            continue
+                        reply = spec['reply'](data) if spec.get('reply') else None
+                        if reply:
+                            await ws.send(reply)
+                            continue
+                        try:
+                            updates = spec['parse'](data)
+                        except (KeyError, IndexError, TypeError, ValueError):
+                            continue
+                        for native, price in updates:
+                            symbol = natives.get(native)
+                            if symbol:
+                                on_price(symbol, exchange, price)
+                finally:
+                    if pinger:
+                        pinger.cancel()
+            metrics.count_error(exchange, 'stream_closed')
+            print_colored(f"⚠️ [{exchange.upper()}] 推送连接被关闭，{backoff}s 后重连...", 'yellow')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.count_error(exchange, 'stream_error')
+            print_colored(f"⚠️ [{exchange.upper()}] 推送连接错误: {e}，{backoff}s 后重连...", 'yellow')
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+async def poll_exchange(exchange, symbols, on_price, interval, fetch_options):
+    """不支持推送的交易所回退为 REST 轮询，结果走同一个回调"""
+    loop = asyncio.get_running_loop()
+    batch_options = {k: v for k, v in fetch_options.items() if k.startswith('batch_')}
+    plan = compile_request_plan([(s, exchange) for s in symbols], **batch_options)
+    max_workers = fetch_options.get('max_workers', 16)
+    tick_deadline = fetch_options.get('tick_deadline')
+    while True:
+        results = await loop.run_in_executor(None, functools.partial(fetch_prices, plan, max_workers, tick_deadline))
+        for (symbol, _), (price, error) in results.items():
+            if error:
+                print_aligned(time.strftime("%Y-%m-%d %H:%M:%S"), exchange, format_symbol(symbol), error, 0, is_error=True)
+            else:
+                on_price(symbol, exchange, price)
+        await asyncio.sleep(interval)
+
+def make_stream_handler(symbols_configs, exchanges, price_gap_threshold, max_price_age=30):
+    """
+    构造推送回调：每条价格更新立即更新 last_prices 并检查报警（而不是等定时轮询）。
+    价格未变化的更新直接忽略。
+    :param max_price_age: 比价只使用该秒数内收到的价格（断线或轮询失败的交易所价格会冻结），0 不限制
+    """
+    configs = {sc['symbol']: sc for sc in symbols_configs}
+    is_multi_exchange = len(exchanges) > 1
+    gap_alert_active = {}  # dict: symbol -> 是否处于比价报警状态（仅在进入报警时提示一次）
+
+    def on_price(symbol, exchange, price):
+        if first_price_time is None:
+            report_first_price()
+        key = (symbol, exchange)
+        if last_prices.get(key) == price:
+            metrics.mark_price(key)  # 价格未变，但数据仍是新的
+            return
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        if not is_multi_exchange:
+            process_single_exchange(timestamp, configs[symbol], exchange, {key: (price, None)})
+            return
+
+        formatted_symbol = format_symbol(symbol)
+        change_pct = calc_change_pct(key, price)
+        print_aligned(timestamp, exchange, formatted_symbol, price, change_pct, is_invalid=price <= 0)
+        if price > 0:
+            check_change_alert(configs[symbol], exchange, change_pct)
+        record_price(key, price)
+
+        now = time.time()
+        price_times = metrics.price_times
+        prices = {ex: last_prices[(symbol, ex)] for ex in exchanges if last_prices.get((symbol, ex), 0) > 0
+                  and (not max_price_age or now - price_times.get((symbol, ex), 0) <= max_price_age)}
+        if len(prices) < 2:
+            return
+        threshold = configs[symbol].get('price_gap_threshold', price_gap_threshold)
+        gap_pct, buy_ex, sell_ex = best_spread(prices)
+        is_gap_alert = 0 < threshold <= gap_pct
+        if dashboard is not None:
+            dashboard.set_gap(formatted_symbol, gap_pct, is_gap_alert)
+        if is_gap_alert and not gap_alert_active.get(symbol):
+            report_gap_alert(symbol, formatted_symbol, prices, gap_pct, threshold, buy_ex, sell_ex)
+        gap_alert_active[symbol] = is_gap_alert
+
+    return on_price
+
+async def run_stream_mode(symbols_configs, exchanges, on_price, interval, stream_urls, fetch_options):
+    """推送模式主协程：支持推送的交易所走 WebSocket，其余回退为 REST 轮询"""
+    symbols = [sc['symbol'] for sc in symbols_configs]
+    tasks = []
+    listed = {exchange: [symbol for symbol, _ in prune_unlisted([(s, exchange) for s in symbols])] for exchange in exchanges}
+    for exchange in exchanges:
+        if not listed[exchange]:
+            continue
+        if EXCHANGE_ADAPTERS[exchange].stream:
+            tasks.append(stream_exchange(exchange, listed[exchange], on_price, stream_urls.get(exchange)))
+        else:
+            print_colored(f"ℹ️ [{exchange.upper()}] 不支持推送，回退为 {interval}s 轮询。", 'yellow')
+            tasks.append(poll_exchange(exchange, listed[exchange], on_price, interval, fetch_options))
+    if not tasks:
+        print("⚠️ 配置的币种在所选交易所均未上架，没有可订阅的交易对，退出。")
+        sys.exit(2)
+    await asyncio.gather(*tasks)
+
+def start_dashboard(config, symbols_configs, exchanges):
+    """display_mode 为 dashboard 时启用原地刷新仪表盘，之后的价格和报警输出都进入仪表盘"""
+    global dashboard
+    if config.get('display_mode', 'log') != 'dashboard':
+        return
+    dashboard = DashboardRenderer([format_symbol(sc['symbol']) for sc in symbols_configs], exchanges,
+                                  fps=config.get('render_fps', 5), show_gap=len(exchanges) > 1)
+    dashboard.start()
+
+@dataclass
+class Monitor:
+    """轮询模式运行时状态：编译好的请求计划、调度周期、限频和比价矩阵"""
+    symbols_configs: list
+    exchanges: list
+    price_gap_threshold: float
+    max_workers: int
+    tick_deadline: float
+    plans: dict  # dict: exchange -> RequestPlan
+    periods: dict  # dict: exchange -> 轮询周期（秒）
+    limiter: dict  # dict: exchange -> TokenBucket
+    spread_matrix: object = None
+    config: dict = None  # 交易对列表变化时重新编译计划用
+    pairs: list = field(default_factory=list)  # 配置的全部 (symbol, exchange)，含未上架的
+    universe_version: int = 0  # 编译计划时 symbol_universe 的版本
+
+    @property
+    def is_multi_exchange(self):
+        return len(self.exchanges) > 1
+
+def apply_base_urls(config):
+    """配置 base_urls 覆盖交易所 REST 地址（如指向本地模拟交易所）"""
+    for exchange, url in (config.get('base_urls') or {}).items():
+        if exchange in EXCHANGE_ADAPTERS:
+            EXCHANGE_ADAPTERS[exchange].base_url = url.rstrip('/')
+
+def setup_alert_rules(config, symbols_configs, exchanges, verbose=True):
+    """创建报警规则引擎（单个交易所模式），verbose 时打印各币种档位"""
+    global alert_engine
+    alert_engine = AlertEngine()
+    if len(exchanges) > 1:
+        return
+    for sc in symbols_configs:
+        rules = load_alert_rules(sc, config.get('alert_hysteresis', 0.0), config.get('alert_cooldown', 0.0))
+        for rule in rules:
+            alert_engine.add_rule((sc['symbol'], exchanges[0]), rule)
+        if verbose:
+            levels = ', '.join(f"{'↑' if r.direction == 'up' else '↓'}{r.level}" for r in rules[:6])
+            more = f" 等 {len(rules)} 条" if len(rules) > 6 else ''
+            print(f"  - {format_symbol(sc['symbol'])}: {levels or '无报警档位'}{more}")
+
+def build_fetch_plans(config, pairs, rate_shares=None):
+    """
+    按配置编译请求计划（URL 预渲染、提取函数预解析）并计算各交易所轮询周期和限频。
+    :param pairs: [(symbol, exchange), ...]
+    :param rate_shares: dict: exchange -> 该交易所分布在几个进程上（限频按份数均分，总请求速率不变）
+    :return: (plans, periods, limiter)
+    """
+    batch_options = {
+        'batch_mode': config.get('batch_mode', True),
+        'batch_min_symbols': config.get('batch_min_symbols', 2),
+        'batch_exclude': config.get('batch_exclude') or [],
+        'critical': {sc['symbol'] for sc in config['symbols'] if sc.get('critical')},
+    }
+    by_exchange = {}
+    for symbol, exchange in pairs:
+        by_exchange.setdefault(exchange, []).append((symbol, exchange))
+    plans = {exchange: compile_request_plan(exchange_pairs, **batch_options)
+             for exchange, exchange_pairs in by_exchange.items()}
+
+    # 每个交易所独立的轮询周期和令牌桶限频
+    rate_limits = {name: adapter.rate_limit for name, adapter in EXCHANGE_ADAPTERS.items()}
+    rate_limits.update(config.get('rate_limits') or {})
+    for exchange, shares in (rate_shares or {}).items():
+        if rate_limits.get(exchange):
+            rate_limits[exchange] /= shares
+    # 令牌桶容量至少为一轮的最多请求数，一轮的请求不会被自己的限频截掉；平均速率由 exchange_periods 的周期保证
+    limiter = {exchange: TokenBucket(rate_limits[exchange], max(rate_limits[exchange], tick_burst(plans[exchange])))
+               for exchange in plans if rate_limits.get(exchange)}
+    periods = exchange_periods(plans, config['interval'], config.get('exchange_intervals'), rate_limits)
+    return plans, periods, limiter
+
+def build_monitor(config, exchanges):
+    """编译所有交易对的抓取计划，并为比价模式创建价格矩阵"""
+    symbols_configs = config['symbols']
+    price_gap_threshold = config.get('price_gap_threshold', 1.0)
+    pairs = [(sc['symbol'], exchange) for exchange in exchanges for sc in symbols_configs]
+    plans, periods, limiter = build_fetch_plans(config, prune_unlisted(pairs))
+
+    # 比价模式：币种 × 交易所价格矩阵，每轮一次向量化计算所有价差
+    spread_matrix = None
+    if len(exchanges) > 1:
+        spread_matrix = SpreadMatrix([sc['symbol'] for sc in symbols_configs], exchanges,
+                                     [sc.get('price_gap_threshold', price_gap_threshold) for sc in symbols_configs])
+    return Monitor(symbols_configs, exchanges, price_gap_threshold, config.get('max_workers', 16),
+                   config.get('tick_deadline', 3.0), plans, periods, limiter, spread_matrix,
+                   config, pairs, symbol_universe.version)
+
+def apply_listing_changes(monitor):
+    """
+    交易对列表刷新后有新上架/下架的币种时重新编译轮询计划。
+    :return: 计划是否有变化（调用方需按新的 monitor.periods 重建调度器）
+    """
+    version = symbol_universe.version
+    if version == monitor.universe_version:
+        return False
+    monitor.universe_version = version
+    active = {key for plan in monitor.plans.values() for key in plan.pairs}
+    pairs = prune_unlisted(monitor.pairs, verbose=False)
+    if not pairs or set(pairs) == active:
+        return False
+    for symbol, exchange in pairs:
+        if (symbol, exchange) not in active:
+            print_colored(f"ℹ️ [{exchange.upper()}] 新上架: {format_symbol(symbol)}，开始轮询", 'green')
+    for symbol, exchange in active.difference(pairs):
+        print_colored(f"⚠️ [{exchange.upper()}] 已下架: {format_symbol(symbol)}，停止轮询", 'yellow')
+    monitor.plans, monitor.periods, monitor.limiter = build_fetch_plans(monitor.config, pairs)
+    return True
+
+def run_tick(monitor, due):
+    """
+    执行一轮：抓取到期交易所的价格，更新比价矩阵，检查报警并输出。
+    :param due: 本轮到期的交易所列表
+    :return: 本轮抓取结果 dict: (symbol, exchange) -> (价格, 错误)
+    """
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    plans = monitor.plans
+    tick_plan = plans[due[0]] if len(due) == 1 else merge_plans(plans[ex] for ex in due)
+    fetch_start = time.perf_counter()
+    results = fetch_prices(tick_plan, monitor.max_workers, monitor.tick_deadline, monitor.limiter)
+    metrics.observe_phase('fetch', time.perf_counter() - fetch_start)
+    process_results(monitor, results, timestamp)
+    return results
+
+def process_results(monitor, results, timestamp=None):
+    """
+    处理一轮结果：更新比价矩阵，检查报警并输出。
+    :param results: dict: (symbol, exchange) -> (价格, 错误)，只包含本轮有更新的交易对
+    """
+    timestamp = timestamp or time.strftime("%Y-%m-%d %H:%M:%S")
+    process_start = time.perf_counter()
+    if first_price_time is None and any(error is None for _, error in results.values()):
+        report_first_price()
+    metrics.take_render_seconds()
+    if monitor.is_multi_exchange:
+        monitor.spread_matrix.apply(results)
+        spreads = monitor.spread_matrix.compute()
+    for i, sc in enumerate(monitor.symbols_configs):
+        if not monitor.is_multi_exchange:
+            process_single_exchange(timestamp, sc, monitor.exchanges[0], results)
+        else:
+            process_multi_exchange(timestamp, sc, monitor.exchanges, results, monitor.price_gap_threshold,
+                                   spread=spreads[i], matrix=monitor.spread_matrix)
+    # 报警计算 = 处理耗时 - 终端输出耗时；仪表盘模式的输出在刷新线程中单独统计
+    render_seconds = metrics.take_render_seconds()
+    metrics.observe_phase('alerts', time.perf_counter() - process_start - render_seconds)
+    if dashboard is None:
+        metrics.observe_phase('render', render_seconds)
+    metrics.tick_done()
+
+# ---------------- 多进程分片 ----------------
+
+def resolve_workers(workers):
+    """workers 配置: 0/1 单进程，'auto' 为 CPU 核数 - 1（留一个核给协调进程）"""
+    if workers == 'auto':
+        return max(1, (os.cpu_count() or 1) - 1)
+    return max(0, int(workers or 0))
+
+def shard_pairs(plans, workers):
+    """
+    把抓取计划拆成 workers 份：走批量接口的交易所整体分给一个进程（全量行情只请求和解析一次），
+    逐个请求的交易对按币种分散；按交易对数从大到小贪心分配给负载最小的进程。
+    :return: [[(symbol, exchange), ...], ...]
+    """
+    units = []
+    for plan in plans.values():
+        units.extend(list(batch.keys.values()) for batch in plan.batches)
+        units.extend([(request.symbol, request.exchange)] for request in plan.singles)
+        units.extend([key] for key in plan.unsupported)
+    shards = [[] for _ in range(workers)]
+    for unit in sorted(units, key=len, reverse=True):
+        min(shards, key=len).extend(unit)
+    return [shard for shard in shards if shard]
+
+def shard_worker(table_name, slots, config, rate_shares, events):
+    """
+    分片工作进程：按自己的调度周期抓取并解析负责的交易对，结果写入共享内存价格表。
+    指标（请求耗时、错误、对冲、熔断状态、抓取耗时）和提示消息每轮通过 events 队列交给协调进程。
+    :param slots: dict: (symbol, exchange) -> 价格表槽位
+    :param events: multiprocessing 队列，元素为 ('message', 文本, 颜色) 或 ('metrics', 记录, 熔断状态, 抓取耗时)
+    """
+    global message_forwarder
+
+    def forward_message(text, color):
+        events.put(('message', text, color))
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C 由协调进程处理
+    message_forwarder = forward_message
+    metrics.forwarded = []
+    configure_http(config)
+    apply_base_urls(config)
+    if config.get('symbol_discovery', True):
+        # 协调进程已写过缓存：不论是否过期都直接使用（由协调进程负责刷新），保证原生符号与协调进程一致
+        discover_symbols(list(dict.fromkeys(ex for _, ex in slots)), config.get('symbol_cache_file') or '', math.inf)
+    table = SharedPriceTable(name=table_name)
+    plans, periods, limiter = build_fetch_plans(config, list(slots), rate_shares)
+    max_workers = config.get('max_workers', 16)
+    tick_deadline = config.get('tick_deadline', 3.0)
+    scheduler = TickScheduler(periods)
+    while True:
+        due = scheduler.wait()
+        plan = plans[due[0]] if len(due) == 1 else merge_plans(plans[ex] for ex in due)
+        fetch_start = time.perf_counter()
+        results = fetch_prices(plan, max_workers, tick_deadline, limiter)
+        fetch_seconds = time.perf_counter() - fetch_start
+        for key, (price, error) in results.items():
+            table.write(slots[key], price, error)
+        breakers = {exchange: breaker.state for exchange, breaker in circuit_breakers.items()}
+        events.put(('metrics', metrics.take_forwarded(), breakers, fetch_seconds))
+
+class ShardPool:
+    """
+    协调进程持有的分片：共享内存价格表和工作进程（spawn 启动，各平台行为一致），
+    工作进程意外退出时自动重启。价格走共享内存，指标和提示消息走每个工作进程各自的事件队列
+    （重启时换新队列，被终止的进程不会留下占用中的队列锁）。
+    """
+
+    BREAKER_SEVERITY = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+    def __init__(self, config, plans, workers):
+        self.keys = [key for plan in plans.values() for key in plan.pairs]
+        slots = {key: i for i, key in enumerate(self.keys)}
+        self.table = SharedPriceTable(len(self.keys))
+        self.shards = shard_pairs(plans, workers)
+        rate_shares = collections.Counter(ex for shard in self.shards for ex in {e for _, e in shard})
+        self.args = [(self.table.name, {key: slots[key] for key in shard}, config, dict(rate_shares))
+                     for shard in self.shards]
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue() for _ in self.args]
+        self.processes = [self._start(args, events) for args, events in zip(self.args, self.queues)]
+        self.breakers = [{} for _ in self.args]  # 各工作进程上报的熔断状态: exchange -> state
+        self._seqs = [0] * len(self.keys)
+
+    def _start(self, args, events):
+        process = self._context.Process(target=shard_worker, args=args + (events,), name='shard', daemon=True)
+        process.start()
+        return process
+
+    def check_workers(self):
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                print_colored(f"⚠️ 分片进程 {i + 1} 已退出（退出码 {process.exitcode}），重新启动", 'yellow')
+                self.queues[i].close()
+                self.queues[i] = self._context.Queue()
+                self.breakers[i] = {}
+                self.processes[i] = self._start(self.args[i], self.queues[i])
+
+    def drain_events(self):
+        """
+        汇总工作进程交来的指标并输出其提示消息。
+        同一交易所分布在多个进程时，熔断状态取最严重的一个，写入本进程的熔断器供指标导出。
+        """
+        for i, events in enumerate(self.queues):
+            while True:
+                try:
+                    event = events.get_nowait()
+                except (queue.Empty, OSError, EOFError):
+                    break
+                if event[0] == 'message':
+                    print_colored(event[1], event[2])
+                    continue
+                _, records, breakers, fetch_seconds = event
+                metrics.merge_forwarded(records)
+                metrics.observe_phase('fetch', fetch_seconds)
+                self.breakers[i] = breakers
+        states = {}
+        for breakers in self.breakers:
+            for exchange, state in breakers.items():
+                if self.BREAKER_SEVERITY[state] >= self.BREAKER_SEVERITY[states.get(exchange, CircuitBreaker.CLOSED)]:
+                    states[exchange] = state
+        for exchange, state in states.items():
+            get_breaker(exchange).state = state
+
+    def read_updates(self):
+        """
+        读取自上次以来有更新的槽位（直接读共享内存，不经管道）。
+        :return: dict: (symbol, exchange) -> (价格, 错误)
+        """
+        results = {}
+        seqs, read = self._seqs, self.table.read
+        for slot, key in enumerate(self.keys):
+            seq, price, _, error = read(slot)
+            if seq != seqs[slot]:
+                seqs[slot] = seq
+                results[key] = (None, error) if error else (price, None)
+        return results
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=2)
+        for events in self.queues:
+            events.close()
+        self.table.close()
+
+def run_sharded(monitor, workers, config):
+    """
+    多进程分片模式：工作进程负责抓取和解析，本进程（协调进程）按最短轮询周期读取价格表，
+    检查报警、计算比价并输出。
+    """
+    global shard_pool
+    shard_pool = ShardPool(config, monitor.plans, workers)
+    sizes = ', '.join(str(len(shard)) for shard in shard_pool.shards)
+    print(f"多进程分片: {len(shard_pool.shards)} 个工作进程，各负责交易对数: {sizes}")
+    scheduler = TickScheduler({'shards': min(monitor.periods.values())})
+    while True:
+        scheduler.wait()
+        if apply_listing_changes(monitor):
+            # 有新上架/下架：按新的计划重新分片（工作进程从已更新的缓存读取交易对列表）
+            shard_pool.close()
+            shard_pool = ShardPool(config, monitor.plans, workers)
+            scheduler = TickScheduler({'shards': min(monitor.periods.values())})
+            continue
+        shard_pool.check_workers()
+        shard_pool.drain_events()
+        process_results(monitor, shard_pool.read_updates())
+
+def main(argv=None):
+    global daemon_mode
+    args = parse_args(argv)
+    daemon_mode = args.daemon
+
     # 加载配置（无输入）
-    config = load_config()
+    config = load_config(args.config)
 
-    # 启动时选择模式和交易所
-    exchanges = select_mode_and_exchanges()
+    # 模式和交易所：命令行 > 配置 > 交互选择
+    try:
+        exchanges = resolve_exchanges(config, args.mode, args.exchanges, daemon=args.daemon)
+    except ValueError as e:
+        print(f"⚠️ {e}")
+        sys.exit(2)
     config['exchanges'] = exchanges
 
     symbols_configs = config['symbols']
@@ -293,141 +3050,126 @@ def main():
     music_file = config['music_file']
     price_gap_threshold = config.get('price_gap_threshold', 1.0)
     is_multi_exchange = len(exchanges) > 1
+    configure_http(config)
+    apply_base_urls(config)
+
+    # 后台预热连接（轮询模式）：批量交易所每轮 1 个请求，逐个请求的交易所按币种数并发；
+    # 与下面的初始化和交易对发现并行进行。分片模式的连接在工作进程中，不在这里预热
+    if not config.get('stream_mode') and resolve_workers(config.get('workers', 0)) <= 1:
+        plans, _, _ = build_fetch_plans(config, [(sc['symbol'], exchange) for exchange in exchanges for sc in symbols_configs])
+        plan = merge_plans(plans.values())
+        warm = {batch.exchange: 1 for batch in plan.batches}
+        for request in plan.singles:
+            warm[request.exchange] = warm.get(request.exchange, 0) + 1
+        start_prewarm(warm)
 
-    # 初始化pygame并检查音乐文件（使用Sound以支持不同币种叠加，但同币种不叠加）
+    # 价格历史：环形缓冲区，可选内存映射文件持久化；只有窗口变化率、波动报警或持久化用到时才分配
+    global price_history, change_window
+    change_window = config.get('change_window', 0)
+    history_file = config.get('history_file') or None
+    pair_count = len(symbols_configs) * len(exchanges)
+    if change_window > 0 or history_file or any(sc.get('change_alert_pct', 0) > 0 for sc in symbols_configs):
+        try:
+            price_history = PriceHistory(capacity=config.get('history_capacity', 28800),
+                                         max_pairs=max(pair_count, 64) if history_file else pair_count,
+                                         path=history_file)
+            if history_file:
+                print(f"价格历史: {history_file}（已有 {len(price_history)} 个交易对的记录）")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 价格历史初始化失败: {e}，仅使用上次价格计算变化率。")
+            price_history = None
+    conn_stats_interval = config.get('conn_stats_interval', 60)
+
+    # 运行指标：Prometheus 端点 + 周期汇总行
+    metrics_port = config.get('metrics_port', 0)
+    if metrics_port:
+        try:
+            start_metrics_server(metrics_port)
+            print(f"指标端点: http://127.0.0.1:{metrics_port}/metrics")
+        except OSError as e:
+            print(f"⚠️ 指标端点启动失败: {e}")
+    start_metrics_reporter(config.get('metrics_summary_interval', 60))
+
+    # 检查音乐文件（pygame 在第一次报警时才导入并解码，不拖慢启动）
     alert_sound = None
-    try:
-        pygame.mixer.init()
-        if not os.path.exists(music_file):
-            print(f"⚠️ 警告: 音乐文件 '{music_file}' 不存在，警报将静音。")
-            music_file = None
-        else:
-            alert_sound = pygame.mixer.Sound(music_file)
-            print(f"警报声音加载成功: {music_file} (Sound模式，支持不同币种叠加，同币种顺序播放)")
-    except Exception as e:
-        print(f"pygame初始化失败: {e}，警报功能禁用。")
-        music_file = None
+    if not music_file or not os.path.exists(music_file):
+        print(f"⚠️ 警告: 音乐文件 '{music_file}' 不存在，警报将静音。")
+    else:
+        alert_sound = AlertSound(music_file)
+        print(f"警报声音: {music_file}（首次报警时加载）")
+    # 报警由独立线程分发到各输出端，不阻塞价格采集
+    dispatcher = start_alert_dispatcher(config, alert_sound)
+    print(f"报警输出: {', '.join(sink.name for sink in dispatcher.sinks) or '无'}")
 
-    # 注册信号处理
+    # 注册信号处理（进程管理器用 SIGTERM 停止）
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
     if is_multi_exchange:
         print(f"\n开始监控多个交易所比价报警 {', '.join([e.upper() for e in exchanges])} {len(symbols_configs)} 个币种，价格差距阈值: {price_gap_threshold}%，间隔: {interval}s。按 Ctrl+C 停止。")
     else:
-        print(f"\n开始监控单个交易所价格报警 {exchanges[0].upper()} {len(symbols_configs)} 个币种，高/低阈值如配置，间隔: {interval}s。按 Ctrl+C 停止。")
-    for sc in symbols_configs:
-        sym = sc['symbol']
-        if not is_multi_exchange:
-            print(f"  - {format_symbol(sym)}: 高 {sc['alert_price']}, 低 {sc['low_alert_price']}")
+        print(f"\n开始监控单个交易所价格报警 {exchanges[0].upper()} {len(symbols_configs)} 个币种，报警档位如下（穿越时提示），间隔: {interval}s。按 Ctrl+C 停止。")
+    setup_alert_rules(config, symbols_configs, exchanges)
     print("-" * 70)
 
-    # 定义 ex_display_width 用于 gap_alert 打印（与 print_aligned 一致）
-    ex_display_width = 16
+    # 交易对发现：未上架的币种在第一轮之前剔除，后台定期刷新
+    if config.get('symbol_discovery', True):
+        cache_file = config.get('symbol_cache_file') or ''
+        sources = discover_symbols(exchanges, cache_file, config.get('symbol_cache_ttl', 86400), refresh_in_background=True)
+        labels = {'cache': '缓存', 'expired': '过期缓存（后台更新中）', 'fetched': '已更新', 'stale': '过期缓存',
+                  'failed': '失败', 'unsupported': '不支持'}
+        print("交易对列表: " + ", ".join(f"{ex.upper()} {labels[source]}" for ex, source in sources.items()))
+        start_symbol_refresher(exchanges, cache_file, config.get('symbol_refresh_interval', 3600))
+
+    if config.get('stream_mode'):
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            print("⚠️ 推送模式需要安装 websockets（pip install websockets），回退为轮询模式。")
+        else:
+            print("推送模式：价格更新到达即检查报警。")
+            fetch_options = {
+                'max_workers': config.get('max_workers', 16),
+                'tick_deadline': config.get('tick_deadline', 3.0),
+                'batch_mode': config.get('batch_mode', True),
+                'batch_min_symbols': config.get('batch_min_symbols', 2),
+                'batch_exclude': config.get('batch_exclude') or [],
+            }
+            on_price = make_stream_handler(symbols_configs, exchanges, price_gap_threshold,
+                                           config.get('stream_max_price_age', 30))
+            start_dashboard(config, symbols_configs, exchanges)
+            asyncio.run(run_stream_mode(symbols_configs, exchanges, on_price, interval,
+                                        config.get('stream_urls') or {}, fetch_options))
+            return
+
+    monitor = build_monitor(config, exchanges)
+    if not monitor.plans:
+        print("⚠️ 配置的币种在所选交易所均未上架，没有可轮询的交易对，退出。")
+        sys.exit(2)
+    print("轮询周期: " + ", ".join(f"{ex.upper()} {period:.2f}s" for ex, period in monitor.periods.items()))
 
-    global last_prices, alert_channels
+    workers = resolve_workers(config.get('workers', 0))
+    if workers > 1:
+        start_dashboard(config, symbols_configs, exchanges)
+        run_sharded(monitor, workers, config)
+        return
+
+    last_stats_time = time.monotonic()
+
+    start_dashboard(config, symbols_configs, exchanges)
+    scheduler = TickScheduler(monitor.periods)
     while True:
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        for sc in symbols_configs:
-            symbol = sc['symbol']
-            formatted_symbol = format_symbol(symbol)
-            if not is_multi_exchange:
-                # 单个交易所模式
-                exchange = exchanges[0]
-                alert_price = sc['alert_price']
-                low_alert_price = sc['low_alert_price']
-                current_price, error = get_price(exchange, symbol)
-                key = (symbol, exchange)
-
-                if error:
-                    print_aligned(timestamp, exchange, formatted_symbol, error, 0, is_error=True)
-                else:
-                    last_price = last_prices.get(key, None)
-                    change_pct = ((current_price - last_price) / last_price * 100) if last_price else 0
-
-                    # 检查是否触发报警
-                    is_high_alert = alert_price > 0 and current_price > alert_price
-                    is_low_alert = low_alert_price > 0 and current_price < low_alert_price
-                    is_alert = is_high_alert or is_low_alert
-                    print_aligned(timestamp, exchange, formatted_symbol, current_price, change_pct, is_alert=is_alert)
-
-                    # 获取该币种的channel
-                    channel = alert_channels.get(symbol)
-
-                    # 高价警报
-                    if is_high_alert and alert_sound:
-                        if channel is None or not channel.get_busy():
-                            print_colored(f"⚠️ 高价警报！[{exchange.upper()}] {formatted_symbol} 价格 {current_price:.4f} > {alert_price}！播放声音...", 'red')
-                            channel = alert_sound.play()
-                            alert_channels[symbol] = channel
-
-                    # 低价警报
-                    if is_low_alert and alert_sound:
-                        if channel is None or not channel.get_busy():
-                            print_colored(f"⚠️ 低价警报！[{exchange.upper()}] {formatted_symbol} 价格 {current_price:.4f} < {low_alert_price}！播放声音...", 'red')
-                            channel = alert_sound.play()
-                            alert_channels[symbol] = channel
-
-                    last_prices[key] = current_price
-            else:
-                # 多个交易所模式：比价报警
-                prices = {}
-                errors = {}
-                invalid_prices = {}  # 记录无效价格
-                for exchange in exchanges:
-                    current_price, error = get_price(exchange, symbol)
-                    if error:
-                        errors[exchange] = error
-                    elif current_price > 0:  # 有效价格
-                        prices[exchange] = current_price
-                    else:  # 价格 <=0，无效
-                        invalid_prices[exchange] = current_price
-                        key = (symbol, exchange)
-                        last_price = last_prices.get(key, None)
-                        change_pct = ((current_price - last_price) / last_price * 100) if last_price else 0
-                        print_aligned(timestamp, exchange, formatted_symbol, current_price, change_pct, is_invalid=True)
-                    if not error:  # 无论有效无效，都更新 last_price
-                        key = (symbol, exchange)
-                        last_prices[key] = current_price
-
-                # 处理错误（使用对齐）
-                for exchange, error in errors.items():
-                    print_aligned(timestamp, exchange, formatted_symbol, error, 0, is_error=True)
-
-                # 打印有效价格（使用对齐函数）
-                for exchange, price in prices.items():
-                    key = (symbol, exchange)
-                    last_price = last_prices.get(key, None)
-                    change_pct = ((price - last_price) / last_price * 100) if last_price else 0
-                    print_aligned(timestamp, exchange, formatted_symbol, price, change_pct)
-
-                # 如果有效价格 >=2，计算差距
-                if len(prices) >= 2:
-                    min_p = min(prices.values())
-                    max_p = max(prices.values())
-                    gap_pct = ((max_p - min_p) / min_p) * 100  # 修复：min_p 现在 >0，无除零风险
-                    is_gap_alert = gap_pct >= price_gap_threshold
-
-                    if is_gap_alert:
-                        print_colored(f"⚠️ 价格差距报警！{formatted_symbol} 差距 {gap_pct:.2f}% >= {price_gap_threshold}%", 'red')
-                        # 突出打印价格（使用对齐，基于显示宽）
-                        for exchange, price in prices.items():
-                            ex_base = exchange.upper()
-                            base_width = display_width(ex_base)
-                            pad_chars = max(0, ex_display_width - base_width)
-                            ex_display = ex_base + ' ' * pad_chars
-                            print_colored(f"  [{ex_display}] {price:>14.4f} USDT", 'yellow')
-
-                        # 播放声音
-                        channel = alert_channels.get(symbol)
-                        if alert_sound and (channel is None or not channel.get_busy()):
-                            print_colored(f"播放声音报警...", 'red')
-                            channel = alert_sound.play()
-                            alert_channels[symbol] = channel
-                else:
-                    if len(prices) < 2:
-                        print_colored(f"⚠️ {formatted_symbol} 有效价格不足 ({len(prices)}/ {len(exchanges)})，跳过比价报警。", 'yellow')
+        if apply_listing_changes(monitor):
+            scheduler = TickScheduler(monitor.periods)
+        due = scheduler.wait()
+        for exchange in due:
+            if scheduler.missed[exchange]:
+                print_colored(f"⚠️ [{exchange.upper()}] 处理超时，合并跳过 {scheduler.missed[exchange]} 个 tick", 'yellow')
+        run_tick(monitor, due)
 
-        time.sleep(interval)
+        if conn_stats_interval and time.monotonic() - last_stats_time >= conn_stats_interval:
+            print_connection_stats()
+            last_stats_time = time.monotonic()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
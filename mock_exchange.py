@@ -0,0 +1,416 @@
+#mock_exchange.py
+"""
+本地模拟交易所（不访问真实交易所，用于本地验证、测试和 benchmark.py 基准测试）。
+
+REST 行情：按路径前缀模拟 8 个交易所的单币种/全量行情接口，返回与真实接口相同的字段结构
+    http://127.0.0.1:8780/binance/api/v3/ticker/price?symbol=BTCUSDT
+    前缀: /binance /okx /gate /bitget /kucoin /mexc /huobi /bybit
+在 config.yaml 中通过 base_urls 指向本地地址即可，例如:
+    base_urls: {'币安': 'http://127.0.0.1:8780/binance', 'okx': 'http://127.0.0.1:8780/okx'}
+同时提供各交易所的交易对列表接口（交易对发现），--unlisted okx:SOLUSDT 可让某个交易对在某个交易所未上架。
+可配置延迟、抖动、错误率和超时率；GET /__stats 返回已处理的请求统计。
+
+报警 webhook 接收端：POST /__webhook 记录收到的报警（同样按 --latency 延迟响应，可模拟慢接收端），
+GET /__webhook 返回最近收到的报警。config.yaml 中设置:
+    alert_sinks: [console, webhook]
+    alert_webhook_url: http://127.0.0.1:8780/__webhook
+
+WebSocket 推送：按路径模拟各交易所的订阅/推送协议
+    ws://127.0.0.1:8765/binance  /okx  /gate  /bitget  /kucoin  /huobi  /bybit
+在 config.yaml 中设置 stream_mode: true，并通过 stream_urls 指向本地地址即可，例如:
+    stream_urls: {'币安': 'ws://127.0.0.1:8765/binance', 'okx': 'ws://127.0.0.1:8765/okx'}
+
+用法: python mock_exchange.py --http-port 8780 --latency 0.05 --jitter 0.02 --error-rate 0.01
+      python mock_exchange.py --ws-port 8765 --rate 2 --drop-after 50
+"""
+import argparse
+import asyncio
+import collections
+import gzip
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# 模拟价格（随机游走），key 为大写无分隔符号，如 'BTCUSDT'
+_prices = {}
+
+def canonical(native):
+    """各交易所原生符号 -> 'BTCUSDT'"""
+    return native.replace('-', '').replace('_', '').upper()
+
+def next_price(native, volatility=0.001):
+    """生成下一个模拟价格"""
+    key = canonical(native)
+    price = _prices.get(key)
+    if price is None:
+        price = 100000.0 if key.startswith('BTC') else 3000.0 if key.startswith('ETH') else 100.0
+    price *= 1 + random.uniform(-volatility, volatility)
+    _prices[key] = price
+    return price
+
+# ---------------- REST 行情 ----------------
+
+# 默认上架的交易对（--symbols N 另外生成 S0USDT ... S{N-1}USDT）
+DEFAULT_UNIVERSE = ['BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'BTCUSDC', 'ETHBTC']
+
+def make_universe(extra_symbols=0):
+    return DEFAULT_UNIVERSE + [f"S{i}USDT" for i in range(extra_symbols)]
+
+QUOTES = ('USDT', 'USDC', 'BTC')
+
+def _split(symbol):
+    for quote in QUOTES:
+        if symbol.endswith(quote):
+            return symbol[:-len(quote)], quote
+    return symbol[:-4], symbol[-4:]
+
+# 各交易所原生符号格式：'BTCUSDT' -> 原生符号
+NATIVE_FORMATS = {
+    'binance': lambda s: s,
+    'okx': lambda s: '-'.join(_split(s)),
+    'gate': lambda s: '_'.join(_split(s)),
+    'bitget': lambda s: s,
+    'kucoin': lambda s: '-'.join(_split(s)),
+    'mexc': lambda s: s,
+    'huobi': lambda s: s.lower(),
+    'bybit': lambda s: s,
+}
+
+def _fmt(price):
+    return f"{price:.8f}"
+
+def rest_response(name, path, query, universe):
+    """
+    生成某交易所某接口的响应。
+    :return: (HTTP 状态码, 响应 JSON)
+    """
+    native = NATIVE_FORMATS[name]
+    listed = {native(s) for s in universe}
+    one = query.get('symbol') or query.get('instId') or query.get('currency_pair')
+    if one is not None and one not in listed:
+        return 400, {"code": 400, "msg": f"Invalid symbol: {one}"}
+    symbols = [one] if one is not None else [native(s) for s in universe]
+
+    pairs = [(native(s),) + _split(s) for s in universe]
+
+    if name in ('binance', 'mexc'):
+        if path == '/api/v3/exchangeInfo':
+            status = 'TRADING' if name == 'binance' else '1'
+            return 200, {"symbols": [{"symbol": n, "baseAsset": b, "quoteAsset": q, "status": status} for n, b, q in pairs]}
+        if path == '/api/v3/ticker/price':
+            rows = [{"symbol": s, "price": _fmt(next_price(s))} for s in symbols]
+            return 200, rows[0] if one is not None else rows
+        if path == '/api/v3/ping':
+            return 200, {}
+    elif name == 'okx':
+        if path in ('/api/v5/market/ticker', '/api/v5/market/tickers'):
+            return 200, {"code": "0", "msg": "", "data": [{"instId": s, "last": _fmt(next_price(s))} for s in symbols]}
+        if path == '/api/v5/public/instruments':
+            return 200, {"code": "0", "data": [{"instId": n, "baseCcy": b, "quoteCcy": q, "state": "live"} for n, b, q in pairs]}
+        if path == '/api/v5/public/time':
+            return 200, {"code": "0", "data": [{"ts": str(int(time.time() * 1000))}]}
+    elif name == 'gate':
+        if path == '/api/v4/spot/tickers':
+            return 200, [{"currency_pair": s, "last": _fmt(next_price(s))} for s in symbols]
+        if path == '/api/v4/spot/currency_pairs':
+            return 200, [{"id": n, "base": b, "quote": q, "trade_status": "tradable"} for n, b, q in pairs]
+        if path == '/api/v4/spot/time':
+            return 200, {"server_time": int(time.time() * 1000)}
+    elif name == 'bitget':
+        if path == '/api/v2/spot/market/tickers':
+            return 200, {"code": "00000", "data": [{"symbol": s, "lastPr": _fmt(next_price(s))} for s in symbols]}
+        if path == '/api/v2/spot/public/symbols':
+            return 200, {"code": "00000", "data": [{"symbol": n, "baseCoin": b, "quoteCoin": q, "status": "online"} for n, b, q in pairs]}
+        if path == '/api/v2/public/time':
+            return 200, {"code": "00000", "data": {"serverTime": str(int(time.time() * 1000))}}
+    elif name == 'kucoin':
+        if path == '/api/v1/market/stats':
+            return 200, {"code": "200000", "data": {"symbol": one, "last": _fmt(next_price(one))}}
+        if path == '/api/v1/market/allTickers':
+            return 200, {"code": "200000", "data": {"time": int(time.time() * 1000),
+                                                    "ticker": [{"symbol": s, "last": _fmt(next_price(s))} for s in symbols]}}
+        if path == '/api/v2/symbols':
+            return 200, {"code": "200000", "data": [{"symbol": n, "baseCurrency": b, "quoteCurrency": q, "enableTrading": True}
+                                                    for n, b, q in pairs]}
+        if path == '/api/v1/timestamp':
+            return 200, {"code": "200000", "data": int(time.time() * 1000)}
+    elif name == 'huobi':
+        if path == '/market/detail/merged':
+            return 200, {"status": "ok", "ch": f"market.{one}.detail.merged", "tick": {"close": next_price(one)}}
+        if path == '/market/tickers':
+            return 200, {"status": "ok", "data": [{"symbol": s, "close": next_price(s)} for s in symbols]}
+        if path == '/v1/common/symbols':
+            return 200, {"status": "ok", "data": [{"symbol": n, "base-currency": b.lower(), "quote-currency": q.lower(), "state": "online"}
+                                                  for n, b, q in pairs]}
+        if path == '/v1/common/timestamp':
+            return 200, {"status": "ok", "data": int(time.time() * 1000)}
+    elif name == 'bybit':
+        if path == '/v5/market/tickers':
+            return 200, {"retCode": 0, "result": {"category": "spot",
+                                                  "list": [{"symbol": s, "lastPrice": _fmt(next_price(s))} for s in symbols]}}
+        if path == '/v5/market/instruments-info':
+            return 200, {"retCode": 0, "result": {"category": "spot", "list": [
+                {"symbol": n, "baseCoin": b, "quoteCoin": q, "status": "Trading"} for n, b, q in pairs]}}
+        if path == '/v5/market/time':
+            return 200, {"retCode": 0, "result": {"timeSecond": str(int(time.time()))}}
+    return 404, {"code": 404, "msg": f"unknown path: {path}"}
+
+@dataclass
+class MockSettings:
+    latency: float = 0.0  # 基础延迟（秒）
+    jitter: float = 0.0  # 延迟抖动（±秒）
+    error_rate: float = 0.0  # 返回 500 的概率
+    timeout_rate: float = 0.0  # 挂起不响应（直到 timeout_sleep 秒后）的概率
+    timeout_sleep: float = 10.0
+    unlisted: dict = field(default_factory=dict)  # 路径前缀 -> 该交易所未上架的交易对集合，如 {'okx': {'SOLUSDT'}}
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, settings=None, universe=None):
+        super().__init__(address, MockRequestHandler)
+        self.settings = settings or MockSettings()
+        self.universe = universe or make_universe()
+        self.listed = {name: [s for s in self.universe if s not in self.settings.unlisted.get(name, ())]
+                       for name in NATIVE_FORMATS}  # 各交易所实际上架的交易对
+        self.stats = {'requests': 0, 'errors': 0, 'timeouts': 0, 'webhooks': 0}
+        self.webhooks = collections.deque(maxlen=1000)  # 最近收到的 webhook 报警
+        self.stats_lock = threading.Lock()
+
+    def count(self, field):
+        with self.stats_lock:
+            self.stats[field] += 1
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive
+    disable_nagle_algorithm = True  # 头和正文分两次写，避免 Nagle + 延迟确认带来的 40ms 额外延迟
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass  # 客户端进程被终止，keep-alive 连接被重置
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端已超时断开
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        if parts.path == '/__stats':
+            with server.stats_lock:
+                self._send(200, dict(server.stats))
+            return
+        if parts.path == '/__webhook':
+            with server.stats_lock:
+                self._send(200, list(server.webhooks))
+            return
+        name, _, path = parts.path.lstrip('/').partition('/')
+        if name not in NATIVE_FORMATS:
+            self._send(404, {"msg": f"unknown exchange: {name}"})
+            return
+        server.count('requests')
+
+        settings = server.settings
+        delay = max(0.0, settings.latency + random.uniform(-settings.jitter, settings.jitter))
+        roll = random.random()
+        if roll < settings.timeout_rate:
+            server.count('timeouts')
+            delay = settings.timeout_sleep
+        if delay:
+            time.sleep(delay)
+        if settings.timeout_rate <= roll < settings.timeout_rate + settings.error_rate:
+            server.count('errors')
+            self._send(500, {"code": 500, "msg": "mock internal error"})
+            return
+
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        status, payload = rest_response(name, '/' + path, query, server.listed[name])
+        self._send(status, payload)
+
+    def do_POST(self):
+        if urlsplit(self.path).path == '/__webhook':
+            self._receive_webhook()
+        else:
+            self.do_GET()
+
+    def _receive_webhook(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send(400, {"msg": "invalid json"})
+            return
+        if server.settings.latency:
+            time.sleep(server.settings.latency)
+        with server.stats_lock:
+            server.webhooks.append(payload)
+            server.stats['webhooks'] += 1
+        self._send(200, {"ok": True})
+
+def serve_http(host, port, settings=None, universe=None, ready=None):
+    """启动模拟 REST 服务器并一直运行；ready 为可选的 multiprocessing.Event"""
+    server = MockHTTPServer((host, port), settings, universe)
+    if ready is not None:
+        ready.set()
+    else:
+        print(f"模拟行情服务器已启动: http://{host}:{port}/<{'|'.join(NATIVE_FORMATS)}>")
+    server.serve_forever()
+
+# ---------------- WebSocket 推送 ----------------
+
+# 各交易所推送协议：
+#   subscribe: 客户端订阅消息(dict) -> 原生符号列表
+#   update: (原生符号, 价格) -> 推送消息（str 或 bytes）
+WS_PROTOCOLS = {
+    'binance': {
+        'subscribe': lambda m: [p.split('@')[0].upper() for p in m.get('params', [])] if m.get('method') == 'SUBSCRIBE' else [],
+        'update': lambda s, p: json.dumps({"e": "24hrMiniTicker", "E": int(time.time() * 1000), "s": s, "c": f"{p:.8f}"}),
+    },
+    'okx': {
+        'subscribe': lambda m: [a['instId'] for a in m.get('args', [])] if m.get('op') == 'subscribe' else [],
+        'update': lambda s, p: json.dumps({"arg": {"channel": "tickers", "instId": s}, "data": [{"instId": s, "last": f"{p:.8f}"}]}),
+    },
+    'gate': {
+        'subscribe': lambda m: list(m.get('payload', [])) if m.get('event') == 'subscribe' else [],
+        'update': lambda s, p: json.dumps({"time": int(time.time()), "channel": "spot.tickers", "event": "update",
+                                           "result": {"currency_pair": s, "last": f"{p:.8f}"}}),
+    },
+    'bitget': {
+        'subscribe': lambda m: [a['instId'] for a in m.get('args', [])] if m.get('op') == 'subscribe' else [],
+        'update': lambda s, p: json.dumps({"action": "snapshot", "arg": {"instType": "SPOT", "channel": "ticker", "instId": s},
+                                           "data": [{"instId": s, "lastPr": f"{p:.8f}"}]}),
+    },
+    'kucoin': {
+        'subscribe': lambda m: m['topic'].split(':', 1)[1].split(',') if m.get('type') == 'subscribe' else [],
+        'update': lambda s, p: json.dumps({"type": "message", "topic": f"/market/ticker:{s}", "subject": "trade.ticker",
+                                           "data": {"price": f"{p:.8f}"}}),
+    },
+    'huobi': {
+        'subscribe': lambda m: [m['sub'].split('.')[1]] if 'sub' in m else [],
+        'update': lambda s, p: gzip.compress(json.dumps({"ch": f"market.{s}.ticker", "ts": int(time.time() * 1000),
+                                                         "tick": {"close": p}}).encode()),
+    },
+    'bybit': {
+        'subscribe': lambda m: [a.split('.', 1)[1] for a in m.get('args', [])] if m.get('op') == 'subscribe' else [],
+        'update': lambda s, p: json.dumps({"topic": f"tickers.{s}", "type": "snapshot", "data": {"symbol": s, "lastPrice": f"{p:.8f}"}}),
+    },
+}
+
+# 应用层心跳应答
+_PING_REPLIES = {
+    'ping': 'pong',
+}
+
+def _request_path(ws):
+    """兼容新旧版本 websockets 的请求路径获取"""
+    request = getattr(ws, 'request', None)
+    return (request.path if request is not None else ws.path).strip('/').split('?')[0]
+
+async def ws_handler(ws, rate=2.0, drop_after=0):
+    """
+    单个推送连接：解析订阅后按 rate 条/秒/币种推送随机游走价格。
+    drop_after > 0 时推送该数量的消息后主动断开，用于验证断线重连与重新订阅。
+    """
+    name = _request_path(ws)
+    protocol = WS_PROTOCOLS.get(name)
+    if protocol is None:
+        await ws.close(code=4004, reason=f"unknown exchange path: {name}")
+        return
+
+    subscribed = []
+    sent = 0
+
+    async def receiver():
+        async for raw in ws:
+            if raw in _PING_REPLIES:
+                await ws.send(_PING_REPLIES[raw])
+                continue
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                continue
+            if message.get('op') == 'ping' or message.get('type') == 'ping':
+                await ws.send(json.dumps({"op": "pong"}))
+                continue
+            for native in protocol['subscribe'](message):
+                if native not in subscribed:
+                    subscribed.append(native)
+
+    recv_task = asyncio.create_task(receiver())
+    try:
+        while not recv_task.done():
+            await asyncio.sleep(1 / rate)
+            if name == 'huobi':
+                await ws.send(gzip.compress(json.dumps({"ping": int(time.time() * 1000)}).encode()))
+            for native in list(subscribed):
+                await ws.send(protocol['update'](native, next_price(native)))
+                sent += 1
+            if drop_after and sent >= drop_after:
+                await ws.close(code=1001, reason="mock drop")
+                break
+    except Exception:
+        pass
+    finally:
+        recv_task.cancel()
+
+async def serve_ws(host, port, rate, drop_after):
+    """启动模拟推送服务器并一直运行"""
+    import websockets
+
+    async def handler(ws, *_):
+        await ws_handler(ws, rate=rate, drop_after=drop_after)
+
+    async with websockets.serve(handler, host, port):
+        print(f"模拟推送服务器已启动: ws://{host}:{port}/<{'|'.join(WS_PROTOCOLS)}>")
+        await asyncio.Future()
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟交易所")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=0, help="REST 行情端口（0 不启动）")
+    parser.add_argument('--symbols', type=int, default=0, help="额外上架的模拟交易对数量 S0USDT...")
+    parser.add_argument('--latency', type=float, default=0.0, help="REST 基础延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.0, help="REST 延迟抖动（±秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="REST 返回 500 的概率")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="REST 挂起不响应的概率")
+    parser.add_argument('--unlisted', default='', help="未上架的交易对，逗号分隔，如 okx:SOLUSDT,gate:ETHBTC")
+    parser.add_argument('--ws-port', type=int, default=0, help="WebSocket 推送端口（0 不启动）")
+    parser.add_argument('--rate', type=float, default=2.0, help="每个币种每秒推送条数")
+    parser.add_argument('--drop-after', type=int, default=0, help="推送多少条后主动断开（0 不断开）")
+    args = parser.parse_args()
+    if not args.http_port and not args.ws_port:
+        args.ws_port = 8765
+    if args.http_port:
+        unlisted = {}
+        for item in filter(None, args.unlisted.split(',')):
+            name, _, symbol = item.partition(':')
+            unlisted.setdefault(name.strip(), set()).add(symbol.strip().upper())
+        settings = MockSettings(args.latency, args.jitter, args.error_rate, args.timeout_rate, unlisted=unlisted)
+        thread = threading.Thread(target=serve_http, args=(args.host, args.http_port, settings, make_universe(args.symbols)),
+                                  daemon=True)
+        thread.start()
+        if not args.ws_port:
+            thread.join()
+    if args.ws_port:
+        asyncio.run(serve_ws(args.host, args.ws_port, args.rate, args.drop_after))
+
+if __name__ == "__main__":
+    main()
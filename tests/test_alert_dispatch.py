@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+import main
+from mock_exchange import MockHTTPServer
+
+def make_event(symbol='BTCUSDT', kind='level', price=100.0):
+    return main.AlertEvent(symbol, kind, '币安', [(f"{symbol} 突破 {price}", 'red')], {'price': price})
+
+@pytest.fixture
+def webhook_server():
+    server = MockHTTPServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def webhook_url(webhook_server):
+    return f"http://127.0.0.1:{webhook_server.server_address[1]}/__webhook"
+
+def test_burst_is_coalesced_into_one_webhook(webhook_server, webhook_url):
+    dispatcher = main.AlertDispatcher([main.WebhookSink(webhook_url)], coalesce_window=0.2).start()
+    for i in range(5):
+        assert dispatcher.submit(make_event(price=100.0 + i))
+    dispatcher.close(timeout=5)
+
+    received = list(webhook_server.webhooks)
+    assert len(received) == 1
+    assert received[0]['symbol'] == 'BTCUSDT'
+    assert received[0]['type'] == 'level'
+    assert received[0]['count'] == 5
+    assert received[0]['price'] == 104.0  # 保留最新一条
+
+def test_different_symbols_are_not_coalesced(webhook_server, webhook_url):
+    dispatcher = main.AlertDispatcher([main.WebhookSink(webhook_url)], coalesce_window=0.2).start()
+    dispatcher.submit(make_event('BTCUSDT'))
+    dispatcher.submit(make_event('ETHUSDT'))
+    dispatcher.submit(make_event('BTCUSDT', kind='change'))
+    dispatcher.close(timeout=5)
+
+    assert sorted((w['symbol'], w['type'], w['count']) for w in webhook_server.webhooks) == [
+        ('BTCUSDT', 'change', 1), ('BTCUSDT', 'level', 1), ('ETHUSDT', 'level', 1)]
+
+def test_queue_overflow_is_dropped_and_counted(webhook_url):
+    dispatcher = main.AlertDispatcher([main.WebhookSink(webhook_url)], maxsize=2)  # 不启动分发线程，队列不会被取走
+    dropped = main.metrics.alerts['dropped']
+    assert dispatcher.submit(make_event('AUSDT'))
+    assert dispatcher.submit(make_event('BUSDT'))
+    assert dispatcher.submit(make_event('AUSDT'))  # 同类报警合并，不占新位置
+    assert not dispatcher.submit(make_event('CUSDT'))
+    assert main.metrics.alerts['dropped'] == dropped + 1
+    assert dispatcher.depth() == 2
+
+def test_failing_sink_does_not_block_submit(webhook_server, webhook_url):
+    release = threading.Event()
+
+    class StuckSink:
+        name = 'stuck'
+
+        def deliver(self, event):
+            release.wait(5)
+            raise RuntimeError("sink down")
+
+    errors = main.metrics.sink_errors['stuck']
+    dispatcher = main.AlertDispatcher([StuckSink(), main.WebhookSink(webhook_url)]).start()
+    start = time.perf_counter()
+    for i in range(200):
+        dispatcher.submit(make_event(f"S{i}USDT"))
+    assert time.perf_counter() - start < 0.5  # 输出端卡住时入队仍立即返回
+
+    release.set()
+    dispatcher.close(timeout=10)
+    assert main.metrics.sink_errors['stuck'] == errors + 200
+    assert len(webhook_server.webhooks) == 200  # 失败的输出端不影响其他输出端
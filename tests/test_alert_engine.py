@@ -0,0 +1,52 @@
+import main
+
+KEY = ('BTCUSDT', '币安')
+
+def make_engine(*rules):
+    engine = main.AlertEngine()
+    for rule in rules:
+        engine.add_rule(KEY, rule)
+    return engine
+
+def feed(engine, ticks):
+    """依次输入 (时间, 价格)，返回触发时间列表"""
+    fired, prev = [], None
+    for now, price in ticks:
+        if engine.evaluate(KEY, prev, price, now=now):
+            fired.append(now)
+        prev = price
+    return fired
+
+def test_crossing_fires_once_per_crossing():
+    engine = make_engine(main.AlertRule(100, 'up'), main.AlertRule(90, 'down'))
+    assert feed(engine, [(0, 95), (1, 101), (2, 105), (3, 99), (4, 101)]) == [1, 4]
+    assert feed(make_engine(main.AlertRule(90, 'down')), [(0, 95), (1, 89), (2, 80), (3, 91), (4, 89)]) == [1, 4]
+
+def test_one_jump_crosses_several_levels():
+    engine = make_engine(*(main.AlertRule(level, 'up') for level in (100, 110, 120, 130)))
+    fired = engine.evaluate(KEY, 95, 125, now=0)
+    assert sorted(rule.level for rule in fired) == [100, 110, 120]
+
+def test_first_price_beyond_level_fires():
+    engine = make_engine(main.AlertRule(100, 'up'))
+    assert feed(engine, [(0, 105), (1, 106)]) == [0]
+
+def test_hysteresis_requires_leaving_the_band():
+    engine = make_engine(main.AlertRule(100, 'up', hysteresis=1.0))
+    # 99.5 仍在 1% 回差带内，不重新布防；98.9 离开回差带后再次突破才报警
+    assert feed(engine, [(0, 99), (1, 101), (2, 99.5), (3, 101), (4, 98.9), (5, 101)]) == [1, 5]
+
+def test_cooldown_is_minimum_time_between_alerts():
+    engine = make_engine(main.AlertRule(100, 'up', cooldown=10))
+    ticks = [(t, 101 if (t // 3) % 2 else 99) for t in range(0, 40, 3)]
+    fired = feed(engine, ticks)
+    assert len(fired) > 1
+    assert all(b - a >= 10 for a, b in zip(fired, fired[1:]))
+
+def test_crossing_blocked_by_cooldown_fires_when_cooldown_ends():
+    engine = make_engine(main.AlertRule(100, 'up', cooldown=60))
+    assert feed(engine, [(0, 99), (1, 101), (2, 99), (3, 101), (100, 102), (200, 103)]) == [1, 100]
+
+def test_blocked_crossing_that_reverts_is_rearmed():
+    engine = make_engine(main.AlertRule(100, 'up', cooldown=60))
+    assert feed(engine, [(0, 99), (1, 101), (2, 99), (3, 101), (4, 99), (100, 98), (101, 101)]) == [1, 101]
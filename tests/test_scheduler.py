@@ -0,0 +1,48 @@
+import pytest
+
+import main
+
+def make_config(symbols, **overrides):
+    config = {'symbols': [{'symbol': s} for s in symbols], 'interval': 3, 'batch_mode': False}
+    config.update(overrides)
+    return config
+
+SYMBOLS = [f"S{i}USDT" for i in range(30)]
+
+def test_token_bucket_refills_at_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(main.time, 'monotonic', lambda: now[0])
+    bucket = main.TokenBucket(rate=10, capacity=8)
+    assert sum(bucket.try_acquire() for _ in range(20)) == 8
+    now[0] += 0.5
+    assert sum(bucket.try_acquire() for _ in range(20)) == 5
+    now[0] += 100
+    assert sum(bucket.try_acquire() for _ in range(20)) == 8  # 不超过容量
+
+def test_scheduler_has_no_drift_and_merges_missed_ticks():
+    scheduler = main.TickScheduler({'a': 1.0, 'b': 2.0}, start=0.0)
+    assert scheduler.pop_due(0.0) == ['a', 'b']
+    assert scheduler.pop_due(0.5) == []
+    assert scheduler.pop_due(1.2) == ['a']
+    assert scheduler.next_due['a'] == 2.0  # 按截止时间推进，不从 1.2 起算
+    assert scheduler.pop_due(5.5) == ['a', 'b']
+    assert scheduler.missed == {'a': 3, 'b': 1}
+    assert scheduler.next_due == {'a': 6.0, 'b': 6.0}
+
+def test_periods_respect_rate_limit():
+    config = make_config(SYMBOLS, exchange_intervals={'币安': 'auto'})
+    _, periods, _ = main.build_fetch_plans(config, [(s, ex) for ex in ('okx', '币安') for s in SYMBOLS])
+    assert periods['okx'] == pytest.approx(3.0)  # 30 个请求 / 10 次每秒 = 3s，不快于配置
+    assert periods['币安'] == pytest.approx(30 / main.EXCHANGE_ADAPTERS['币安'].rate_limit)
+
+def test_first_tick_is_not_rate_limited_by_its_own_requests():
+    _, _, limiter = main.build_fetch_plans(make_config(SYMBOLS), [(s, 'okx') for s in SYMBOLS])
+    bucket = limiter['okx']
+    assert sum(bucket.try_acquire() for _ in SYMBOLS) == len(SYMBOLS)
+
+def test_bucket_covers_batch_fallback():
+    config = make_config(SYMBOLS, batch_mode=True)
+    plans, _, limiter = main.build_fetch_plans(config, [(s, 'okx') for s in SYMBOLS])
+    assert len(plans['okx'].batches) == 1 and not plans['okx'].singles
+    assert main.tick_burst(plans['okx']) == 1 + len(SYMBOLS)
+    assert limiter['okx'].capacity == 1 + len(SYMBOLS)
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+import main
+from mock_exchange import MockHTTPServer, MockSettings
+
+@pytest.fixture
+def mock_server():
+    server = MockHTTPServer(('127.0.0.1', 0), MockSettings(error_rate=0.5))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_shared_table_recovers_slot_left_mid_write():
+    table = main.SharedPriceTable(1)
+    try:
+        table.SEQ.pack_into(table._buf, table.HEADER_SIZE, 3)  # 写入进程在写入中途被终止
+        assert table.read(0)[3] == main.STALE_ERROR
+        table.write(0, 5.0)
+        seq, price, _, error = table.read(0)
+        assert (seq % 2, price, error) == (0, 5.0, None)
+    finally:
+        table.close()
+
+def test_worker_metrics_and_messages_reach_coordinator(mock_server, monkeypatch):
+    messages = []
+    monkeypatch.setattr(main, 'print_colored', lambda text, color='red': messages.append(text))
+    monkeypatch.setattr(main, 'metrics', main.Metrics())
+    monkeypatch.setattr(main, 'circuit_breakers', {})
+    config = {'symbols': [{'symbol': 'BTCUSDT'}, {'symbol': 'ETHUSDT'}], 'interval': 0.2, 'batch_mode': False,
+              'symbol_discovery': False, 'breaker_failures': 2, 'breaker_cooldown': 60,
+              'base_urls': {'okx': f"{mock_server}/okx", '币安': f"{mock_server}/binance"}}
+    pairs = [(sc['symbol'], ex) for ex in ('okx', '币安') for sc in config['symbols']]
+    plans, _, _ = main.build_fetch_plans(config, pairs)
+    pool = main.ShardPool(config, plans, 2)
+    try:
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            time.sleep(0.2)
+            pool.drain_events()
+            if main.metrics.errors and any(b.state != main.CircuitBreaker.CLOSED for b in main.circuit_breakers.values()):
+                break
+    finally:
+        pool.close()
+
+    assert {ex for ex, _ in main.metrics.requests} == {'okx', '币安'}
+    assert sum(n for (_, error_type), n in main.metrics.errors.items() if error_type == 'http_500') > 0
+    assert main.metrics.phases['fetch'].count > 0
+    assert any(b.state != main.CircuitBreaker.CLOSED for b in main.circuit_breakers.values())
+    assert any('熔断' in text for text in messages)  # 工作进程的熔断提示由协调进程输出
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+import main
+import mock_exchange
+
+pytest.importorskip('websockets')
+
+async def collect_stream(port, drop_after, until, timeout=10.0):
+    """启动本地推送服务器，推送模式订阅币安 BTCUSDT/ETHUSDT，收到 until 条更新后返回"""
+    updates = []
+    done = asyncio.Event()
+
+    def on_price(symbol, exchange, price):
+        updates.append((symbol, exchange, price))
+        if len(updates) >= until:
+            done.set()
+
+    server = asyncio.create_task(mock_exchange.serve_ws('127.0.0.1', port, rate=20, drop_after=drop_after))
+    await asyncio.sleep(0.2)
+    symbols_configs = [{'symbol': 'BTCUSDT'}, {'symbol': 'ETHUSDT'}]
+    client = asyncio.create_task(main.run_stream_mode(symbols_configs, ['币安'], on_price, 1,
+                                                      {'币安': f"ws://127.0.0.1:{port}/binance"}, {}))
+    try:
+        await asyncio.wait_for(done.wait(), timeout)
+    finally:
+        for task in (client, server):
+            task.cancel()
+        await asyncio.gather(client, server, return_exceptions=True)
+    return updates
+
+def test_stream_delivers_prices(free_port):
+    updates = asyncio.run(collect_stream(free_port, drop_after=0, until=10))
+    assert {symbol for symbol, _, _ in updates} == {'BTCUSDT', 'ETHUSDT'}
+    assert all(exchange == '币安' and price > 0 for _, exchange, price in updates)
+
+def test_stream_reconnects_and_resubscribes(free_port):
+    closed = main.metrics.errors[('币安', 'stream_closed')]
+    # 服务器每条连接推送 4 条后断开，收到 12 条说明至少重连并重新订阅了两次
+    updates = asyncio.run(collect_stream(free_port, drop_after=4, until=12, timeout=15))
+    assert main.metrics.errors[('币安', 'stream_closed')] >= closed + 2
+    assert {symbol for symbol, _, _ in updates} == {'BTCUSDT', 'ETHUSDT'}
+
+def test_stale_exchange_price_is_left_out_of_gap_check(monkeypatch):
+    gaps = []
+    monkeypatch.setattr(main, 'report_gap_alert', lambda symbol, *args, **kwargs: gaps.append(symbol))
+    on_price = main.make_stream_handler([{'symbol': 'GAPUSDT'}], ['币安', 'okx'], 1.0, max_price_age=30)
+    on_price('GAPUSDT', '币安', 100.0)
+    on_price('GAPUSDT', 'okx', 100.1)
+    assert gaps == []
+
+    # OKX 推送断开后价格冻结：超过 max_price_age 后不再参与比价
+    main.metrics.price_times[('GAPUSDT', 'okx')] -= 60
+    on_price('GAPUSDT', '币安', 110.0)
+    assert gaps == []
+
+    on_price('GAPUSDT', 'okx', 100.2)  # 恢复推送后重新参与比价
+    assert gaps == ['GAPUSDT']
@@ -0,0 +1,48 @@
+import json
+import threading
+import time
+
+import pytest
+
+import main
+from mock_exchange import MockHTTPServer, MockSettings
+
+@pytest.fixture
+def mock_okx(monkeypatch):
+    """OKX 指向本地模拟交易所，SOLUSDT 未上架"""
+    server = MockHTTPServer(('127.0.0.1', 0), MockSettings(unlisted={'okx': {'SOLUSDT'}}))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(main.EXCHANGE_ADAPTERS['okx'], 'base_url', f"http://127.0.0.1:{server.server_address[1]}/okx")
+    monkeypatch.setattr(main, 'symbol_universe', main.SymbolUniverse())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_fetch_prunes_unlisted_and_writes_cache(mock_okx, tmp_path):
+    cache_file = str(tmp_path / 'symbols.json')
+    assert main.discover_symbols(['okx'], cache_file) == {'okx': 'fetched'}
+    assert main.prune_unlisted([('BTCUSDT', 'okx'), ('SOLUSDT', 'okx')], verbose=False) == [('BTCUSDT', 'okx')]
+    assert main.exchange_symbol('okx', 'BTCUSDT') == 'BTC-USDT'
+    with open(cache_file, encoding='utf-8') as f:
+        assert 'okx' in json.load(f)
+
+def test_expired_cache_is_used_at_once_and_refreshed_in_background(mock_okx, tmp_path):
+    cache_file = str(tmp_path / 'symbols.json')
+    # 过期缓存中 ETHUSDT 未上架、SOLUSDT 已上架（与模拟交易所相反）
+    with open(cache_file, 'w', encoding='utf-8') as f:
+        json.dump({'okx': {'updated': 0, 'instruments': [['BTC-USDT', 'BTC', 'USDT'], ['SOL-USDT', 'SOL', 'USDT']]}}, f)
+
+    assert main.discover_symbols(['okx'], cache_file, refresh_in_background=True) == {'okx': 'expired'}
+    assert main.symbol_universe.is_listed('okx', 'ETHUSDT') is False  # 先按过期缓存剔除，不等待请求
+
+    deadline = time.monotonic() + 5
+    while main.symbol_universe.is_listed('okx', 'ETHUSDT') is False and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert main.symbol_universe.is_listed('okx', 'ETHUSDT') is True
+    assert main.symbol_universe.is_listed('okx', 'SOLUSDT') is False
+    with open(cache_file, encoding='utf-8') as f:
+        assert json.load(f)['okx']['updated'] > 0  # 缓存先于索引更新
+
+def test_missing_cache_blocks_until_fetched(mock_okx, tmp_path):
+    sources = main.discover_symbols(['okx'], str(tmp_path / 'none.json'), refresh_in_background=True)
+    assert sources == {'okx': 'fetched'}